@@ -18,13 +18,14 @@ from pydocquery.queries import (
     query_base,
     is_same_query,
     hash_query,
+    normalize_query,
     MISSING,
     NEGATED_MISSING,
     Asc,
     Desc,
     SortingQuery,
 )
-from pydocquery.queries_compilation import compile_query, evaluate_query
+from pydocquery.queries_compilation import CompiledQuery, compile_query, evaluate_query
 
 
 try:
@@ -59,6 +60,7 @@ __all__ = [
     "query_base",
     "is_same_query",
     "hash_query",
+    "normalize_query",
     "MISSING",
     "NEGATED_MISSING",
     "Asc",
@@ -2,9 +2,12 @@
 #          + All contributors to <https://github.com/smarie/python-pydocquery>
 #
 # License: 3-clause BSD, <https://github.com/smarie/python-pydocquery/blob/master/LICENSE>
-from abc import ABC, abstractmethod
+import sys
 from enum import Enum
-from typing import Any, Dict, Optional, Tuple, TypeVar, Union
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, Type, TypeVar, Union
+from weakref import WeakValueDictionary, ref
 
 
 class RootError(Exception):
@@ -31,9 +34,19 @@ class MissingQueryTargetError(QueryError):
     Such an error can go through a "not" operator, in that case it will switch its truth value from False to True.
     """
 
+    # Instances still have a `__dict__`, since the parent exception classes are not slotted. The slots only keep the
+    # attributes out of it, so that it is never allocated: this makes the creation of these errors faster.
+    __slots__ = ("missingpath", "truth_value", "_str")
+
     def __init__(self, missingpath: Tuple[str, ...]):
         self.missingpath = missingpath
         self.truth_value = False
+        self._str = None
+
+    def __reduce__(self):
+        # the attributes are not stored in the instance __dict__, make sure that the truth value survives pickling and
+        # copying
+        return type(self), (self.missingpath,), {"truth_value": self.truth_value}
 
     def __bool__(self):
         return self.truth_value
@@ -47,30 +60,47 @@ class MissingQueryTargetError(QueryError):
         return NEGATED_MISSING if self.truth_value else MISSING
 
     def __str__(self):
-        path = ".".join(("<metadata_root>",) + self.missingpath)
-        return f"Path {path!r} cannot be found in document."
+        res = self._str
+        if res is None:
+            path = ".".join(("<metadata_root>",) + self.missingpath)
+            res = self._str = f"Path {path!r} cannot be found in document."
+        return res
+
+
+_INVALID_USAGE_MSG = (
+    "Invalid Query usage. Query objects can not be used in multi-operator operations such as `a < b < c`, "
+    "nor using and/or/nor/in, nor being hashed or used in a hash-requiring operation. Please use "
+    "single-operator functions assembled with bitwise operators e.g. `(a < b) & (b < c)`, and use "
+    "`import se_model_manager.queries_lib as ql` in order to find known functions such as `ql.exists()`"
+)
+
+_XOR_MSG = (
+    "The boolean xor operator does not exist in python, therefore ^ is not "
+    "implemented to keep consistency with & and | semantics (boolean and/or). "
+    "Please use `ql.binxor` for the bitwise xor, or explicitly use "
+    "`(a & ~b) | (b & ~a)` for the boolean xor."
+)
 
 
 class InvalidQueryUsageError(QueryError):
     """Raised when :class:`Query` objects are not used correctly."""
 
     def __str__(self):
-        return (
-            "Invalid Query usage. Query objects can not be used in multi-operator operations such as `a < b < c`, "
-            "nor using and/or/nor/in, nor being hashed or used in a hash-requiring operation. Please use "
-            "single-operator functions assembled with bitwise operators e.g. `(a < b) & (b < c)`, and use "
-            "`import se_model_manager.queries_lib as ql` in order to find known functions such as `ql.exists()`"
-        )
+        return self.args[0] if self.args else _INVALID_USAGE_MSG
 
 
-class Query(ABC):
-    """A query"""
+class Query:
+    """A query
+
+    Note: this class is not an `abc.ABC` on purpose, so that ``isinstance(q, Query)`` (used on every node during query
+    traversal) does not go through the slower `ABCMeta.__instancecheck__`.
+    """
 
     __slots__ = ()
 
-    @abstractmethod
     def __init__(self, *args, **kwargs):
         """Instances of this class cant be created, subclassing is mandatory"""
+        raise TypeError(f"Can't instantiate {type(self).__name__} directly, subclassing is mandatory")
 
     # Basic see https://docs.python.org/3/reference/datamodel.html#basic-customization
 
@@ -82,72 +112,72 @@ class Query(ABC):
 
     def __getitem__(self, item):
         # TODO maybe one day
-        #  return FunctionQuery(KnownFunction.GET_ITEM, args=(item,))
+        #  return FunctionQuery._make(KnownFunction.GET_ITEM, (item,))
         raise InvalidQueryUsageError()
 
     def __lt__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.LT(self, rhs)
+        return _mk_lt(self, rhs)
 
     def __le__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.LE(self, rhs)
+        return _mk_le(self, rhs)
 
     def __eq__(self, rhs: Any) -> "TwoSidedOperation":  # type: ignore
-        return TwoSidedOperator.EQ(self, rhs)
+        return _mk_eq(self, rhs)
 
     def __ne__(self, rhs: Any):
-        return TwoSidedOperator.NE(self, rhs)
+        return _mk_ne(self, rhs)
 
     def __gt__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.GT(self, rhs)
+        return _mk_gt(self, rhs)
 
     def __ge__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.GE(self, rhs)
+        return _mk_ge(self, rhs)
 
     # TODO container ? see https://docs.python.org/3/reference/datamodel.html#emulating-container-types
 
     # see https://docs.python.org/3/reference/datamodel.html#emulating-numeric-types
 
     def __add__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.ADD(self, rhs)
+        return _mk_add(self, rhs)
 
     def __radd__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.ADD(rhs, self)
+        return _mk_add(rhs, self)
 
     def __sub__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.SUB(self, rhs)
+        return _mk_sub(self, rhs)
 
     def __rsub__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.SUB(rhs, self)
+        return _mk_sub(rhs, self)
 
     def __mul__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.MUL(self, rhs)
+        return _mk_mul(self, rhs)
 
     def __rmul__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.MUL(rhs, self)
+        return _mk_mul(rhs, self)
 
     def __matmul__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.MATMUL(self, rhs)
+        return _mk_matmul(self, rhs)
 
     def __rmatmul__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.MATMUL(rhs, self)
+        return _mk_matmul(rhs, self)
 
     def __truediv__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.TRUEDIV(self, rhs)
+        return _mk_truediv(self, rhs)
 
     def __rtruediv__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.TRUEDIV(rhs, self)
+        return _mk_truediv(rhs, self)
 
     def __floordiv__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.FLOORDIV(self, rhs)
+        return _mk_floordiv(self, rhs)
 
     def __rfloordiv__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.FLOORDIV(rhs, self)
+        return _mk_floordiv(rhs, self)
 
     def __mod__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.MOD(self, rhs)
+        return _mk_mod(self, rhs)
 
     def __rmod__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.MOD(rhs, self)
+        return _mk_mod(rhs, self)
 
     # def __divmod__(self, rhs: Any) -> "Query":
     #     return TwoSidedOperator.DIVMOD(self, rhs)
@@ -158,127 +188,238 @@ class Query(ABC):
     def __pow__(self, rhs: Any, modulo=None) -> "Query":
         if modulo is not None:
             raise NotImplementedError()
-        return TwoSidedOperator.POW(self, rhs)
+        return _mk_pow(self, rhs)
 
     def __rpow__(self, rhs: Any, modulo=None) -> "Query":
         if modulo is not None:
             raise NotImplementedError()
-        return TwoSidedOperator.POW(rhs, self)
+        return _mk_pow(rhs, self)
 
     def __lshift__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.LSHIFT(self, rhs)
+        return _mk_lshift(self, rhs)
 
     def __rlshift__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.LSHIFT(rhs, self)
+        return _mk_lshift(rhs, self)
 
     def __rshift__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.RSHIFT(self, rhs)
+        return _mk_rshift(self, rhs)
 
     def __rrshift__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.RSHIFT(rhs, self)
+        return _mk_rshift(rhs, self)
 
     def __and__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.AND(self, rhs)
+        return _mk_and(self, rhs)
 
     def __rand__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.AND(rhs, self)
+        return _mk_and(rhs, self)
 
     def __xor__(self, rhs: Any) -> "Query":
         # return TwoSidedOperator.XOR(self, rhs)
-        raise InvalidQueryUsageError(
-            "The boolean xor operator does not exist in python, therefore ^ is not "
-            "implemented to keep consistency with & and | semantics (boolean and/or). "
-            "Please use `ql.binxor` for the bitwise xor, or explicitly use "
-            "`(a & ~b) | (b & ~a)` for the boolean xor."
-        )
+        raise InvalidQueryUsageError(_XOR_MSG)
 
     def __rxor__(self, rhs: Any) -> "Query":
         # return TwoSidedOperator.XOR(rhs, self)
-        raise InvalidQueryUsageError(
-            "The boolean xor operator does not exist in python, therefore ^ is not "
-            "implemented to keep consistency with & and | semantics (boolean and/or). "
-            "Please use `ql.binxor` for the bitwise xor, or explicitly use "
-            "`(a & ~b) | (b & ~a)` for the boolean xor."
-        )
+        raise InvalidQueryUsageError(_XOR_MSG)
 
     def __or__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.OR(self, rhs)
+        return _mk_or(self, rhs)
 
     def __ror__(self, rhs: Any) -> "Query":
-        return TwoSidedOperator.OR(rhs, self)
+        return _mk_or(rhs, self)
 
     # one-sided operators
 
     def __neg__(self) -> "Query":
-        return OneSidedOperator.NEG(self)
+        return _mk_neg(self)
 
     def __pos__(self) -> "Query":
-        return OneSidedOperator.POS(self)
+        return _mk_pos(self)
 
     def __invert__(self):
-        return OneSidedOperator.NOT(self)
+        return _mk_not(self)
+
+
+class _OperatorType(type):
+    """The metaclass of the operator classes.
+
+    As for an ``Enum``, an operator class can be iterated, and its operators can be looked up by value (e.g.
+    ``TwoSidedOperator("<")``) or by name (e.g. ``TwoSidedOperator["LT"]``).
+    """
+
+    def __init__(cls, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the operators of this class by name (in definition order), and by value
+        cls._members = {}
+        cls._values = {}
+
+    def __call__(cls, value):
+        if type(value) is cls:
+            return value
+        try:
+            return cls._values[value]
+        except (KeyError, TypeError):
+            raise ValueError(f"{value!r} is not a valid {cls.__name__}") from None
+
+    def __getitem__(cls, name: str):
+        return cls._members[name]
+
+    def __iter__(cls):
+        return iter(cls._members.values())
 
+    def __len__(cls):
+        return len(cls._members)
 
-class OneSidedOperator(Enum):
+    def __contains__(cls, member) -> bool:
+        return type(member) is cls and cls._members.get(member.name) is member
+
+    @property
+    def __members__(cls) -> Mapping[str, "_Operator"]:
+        return MappingProxyType(cls._members)
+
+
+class _Operator(metaclass=_OperatorType):
+    """Base class for operators.
+
+    Operators are singletons stored as class attributes (e.g. ``TwoSidedOperator.LT``) and compared by identity.
+    They are not ``Enum`` members, so that building a query node does not go through the ``Enum`` machinery.
+    """
+
+    __slots__ = ("name", "value")
+
+    @classmethod
+    def _define(cls, name: str, value: str):
+        """Create the operator `name` of this class. It is stored as a class attribute, e.g. ``TwoSidedOperator.LT``."""
+        o = object.__new__(cls)
+        o.__init__(name, value)
+        setattr(cls, name, o)
+        cls._members[name] = cls._values[o.value] = o
+        return o
+
+    def __init__(self, name: str, value: str):
+        self.name = name
+        self.value = sys.intern(value)
+
+    def __repr__(self):
+        return f"<{type(self).__name__}.{self.name}: {self.value!r}>"
+
+    def __reduce__(self):
+        # Unpickling must return the singleton, not a copy
+        return getattr, (type(self), self.name)
+
+
+class OneSidedOperator(_Operator):
     """An operator that only acts on a single operand (the `target`)"""
 
-    NEG = "-"
-    POS = "+"
-    NOT = "~"
+    __slots__ = ("_prefix",)
+
+    def __init__(self, name: str, value: str):
+        super().__init__(name, value)
+        # precomputed for __str__
+        self._prefix = f"{value} "
+
+    NEG: "OneSidedOperator"
+    POS: "OneSidedOperator"
+    NOT: "OneSidedOperator"
 
     def __call__(self, target) -> "OneSidedOperation":
         """Factory for the corresponding Query"""
-        return OneSidedOperation(operator=self, target=target)
+        o = OneSidedOperation.__new__(OneSidedOperation)
+        o.operator = self
+        o.target = target
+        o._hash = None
+        return o
+
+
+_NEG = OneSidedOperator._define("NEG", "-")
+_POS = OneSidedOperator._define("POS", "+")
+_NOT = OneSidedOperator._define("NOT", "~")
 
 
 class OneSidedOperation(Query):
     """A query involving a `OneSidedOperator`."""
 
-    __slots__ = ("operator", "target")
+    __slots__ = ("operator", "target", "_hash")
 
     def __init__(self, operator: OneSidedOperator, target: Union[Query, Any]):
         self.operator = operator
         self.target = target
+        self._hash = None
 
     def __str__(self):
         """Return e.g. '<foo> == "bar"'"""
-        return f"{self.operator.value} {maybe_parenthesis(self.target)}"
+        return self.operator._prefix + maybe_parenthesis(self.target)
 
     def __repr__(self):
         return f"{self.operator!r}({self.target!r})"
 
+    def __reduce__(self):
+        # The cached hash is not pickled: str hashes differ from one process to another
+        return type(self), (self.operator, self.target)
+
 
-class TwoSidedOperator(Enum):
+class TwoSidedOperator(_Operator):
     """An operator that acts on two operands (left and right-hand side)"""
 
-    LT = "<"
-    LE = "<="
-    EQ = "=="
-    NE = "!="
-    GT = ">"
-    GE = ">="
-    ADD = "+"
-    SUB = "-"
-    MUL = "*"
-    MATMUL = "@"
-    TRUEDIV = "/"
-    FLOORDIV = "//"
-    MOD = "%"
-    POW = "**"
-    LSHIFT = "<<"
-    RSHIFT = ">>"
-    AND = "and"
-    OR = "or"
+    __slots__ = ("_infix",)
+
+    def __init__(self, name: str, value: str):
+        super().__init__(name, value)
+        # precomputed for __str__
+        self._infix = f" {value} "
+
+    LT: "TwoSidedOperator"
+    LE: "TwoSidedOperator"
+    EQ: "TwoSidedOperator"
+    NE: "TwoSidedOperator"
+    GT: "TwoSidedOperator"
+    GE: "TwoSidedOperator"
+    ADD: "TwoSidedOperator"
+    SUB: "TwoSidedOperator"
+    MUL: "TwoSidedOperator"
+    MATMUL: "TwoSidedOperator"
+    TRUEDIV: "TwoSidedOperator"
+    FLOORDIV: "TwoSidedOperator"
+    MOD: "TwoSidedOperator"
+    POW: "TwoSidedOperator"
+    LSHIFT: "TwoSidedOperator"
+    RSHIFT: "TwoSidedOperator"
+    AND: "TwoSidedOperator"
+    OR: "TwoSidedOperator"
 
     def __call__(self, left_hand_side, right_hand_side) -> "TwoSidedOperation":
         """Factory for the corresponding Query"""
-        return TwoSidedOperation(operator=self, left_hand_side=left_hand_side, right_hand_side=right_hand_side)
+        o = TwoSidedOperation.__new__(TwoSidedOperation)
+        o.operator = self
+        o.left_hand_side = left_hand_side
+        o.right_hand_side = right_hand_side
+        o._hash = None
+        return o
+
+
+_LT = TwoSidedOperator._define("LT", "<")
+_LE = TwoSidedOperator._define("LE", "<=")
+_EQ = TwoSidedOperator._define("EQ", "==")
+_NE = TwoSidedOperator._define("NE", "!=")
+_GT = TwoSidedOperator._define("GT", ">")
+_GE = TwoSidedOperator._define("GE", ">=")
+_ADD = TwoSidedOperator._define("ADD", "+")
+_SUB = TwoSidedOperator._define("SUB", "-")
+_MUL = TwoSidedOperator._define("MUL", "*")
+_MATMUL = TwoSidedOperator._define("MATMUL", "@")
+_TRUEDIV = TwoSidedOperator._define("TRUEDIV", "/")
+_FLOORDIV = TwoSidedOperator._define("FLOORDIV", "//")
+_MOD = TwoSidedOperator._define("MOD", "%")
+_POW = TwoSidedOperator._define("POW", "**")
+_LSHIFT = TwoSidedOperator._define("LSHIFT", "<<")
+_RSHIFT = TwoSidedOperator._define("RSHIFT", ">>")
+_AND = TwoSidedOperator._define("AND", "and")
+_OR = TwoSidedOperator._define("OR", "or")
 
 
 class TwoSidedOperation(Query):
     """A query involving a `TwoSidedOperator`."""
 
-    __slots__ = ("operator", "left_hand_side", "right_hand_side")
+    __slots__ = ("operator", "left_hand_side", "right_hand_side", "_hash")
 
     def __init__(
         self, operator: TwoSidedOperator, left_hand_side: Union[Query, Any], right_hand_side: Union[Query, Any]
@@ -286,20 +427,78 @@ class TwoSidedOperation(Query):
         self.operator = operator
         self.left_hand_side = left_hand_side
         self.right_hand_side = right_hand_side
+        self._hash = None
 
     def __str__(self):
         """Return e.g. '<foo> == "bar"'"""
-        return (
-            f"{maybe_parenthesis(self.left_hand_side)} {self.operator.value} {maybe_parenthesis(self.right_hand_side)}"
-        )
+        return maybe_parenthesis(self.left_hand_side) + self.operator._infix + maybe_parenthesis(self.right_hand_side)
 
     def __repr__(self):
         return f"{self.operator!r}({self.left_hand_side!r}, {self.right_hand_side!r})"
 
+    def __reduce__(self):
+        # The cached hash is not pickled: str hashes differ from one process to another
+        return type(self), (self.operator, self.left_hand_side, self.right_hand_side)
+
+
+def _one_sided_factory(op: OneSidedOperator) -> Callable[[Any], OneSidedOperation]:
+    """Return a function building the `OneSidedOperation` nodes for `op`. Used by the `Query` operators."""
+
+    def make(target):
+        o = OneSidedOperation.__new__(OneSidedOperation)
+        o.operator = op
+        o.target = target
+        o._hash = None
+        return o
+
+    return make
+
+
+def _two_sided_factory(op: TwoSidedOperator) -> Callable[[Any, Any], TwoSidedOperation]:
+    """Return a function building the `TwoSidedOperation` nodes for `op`. Used by the `Query` operators."""
+
+    def make(left_hand_side, right_hand_side):
+        o = TwoSidedOperation.__new__(TwoSidedOperation)
+        o.operator = op
+        o.left_hand_side = left_hand_side
+        o.right_hand_side = right_hand_side
+        o._hash = None
+        return o
+
+    return make
+
+
+_mk_neg = _one_sided_factory(_NEG)
+_mk_pos = _one_sided_factory(_POS)
+_mk_not = _one_sided_factory(_NOT)
+_mk_lt = _two_sided_factory(_LT)
+_mk_le = _two_sided_factory(_LE)
+_mk_eq = _two_sided_factory(_EQ)
+_mk_ne = _two_sided_factory(_NE)
+_mk_gt = _two_sided_factory(_GT)
+_mk_ge = _two_sided_factory(_GE)
+_mk_add = _two_sided_factory(_ADD)
+_mk_sub = _two_sided_factory(_SUB)
+_mk_mul = _two_sided_factory(_MUL)
+_mk_matmul = _two_sided_factory(_MATMUL)
+_mk_truediv = _two_sided_factory(_TRUEDIV)
+_mk_floordiv = _two_sided_factory(_FLOORDIV)
+_mk_mod = _two_sided_factory(_MOD)
+_mk_pow = _two_sided_factory(_POW)
+_mk_lshift = _two_sided_factory(_LSHIFT)
+_mk_rshift = _two_sided_factory(_RSHIFT)
+_mk_and = _two_sided_factory(_AND)
+_mk_or = _two_sided_factory(_OR)
+
 
 def maybe_parenthesis(q: Any) -> str:
     """Used in string representations for operators, to add parenthesis if needed."""
 
+    # fast path: exact type lookup
+    to_str = _STR_DISPATCH.get(type(q))
+    if to_str is not None:
+        return to_str(q)
+
     if isinstance(q, (OneSidedOperation, TwoSidedOperation)):
         return f"({q})"
     elif isinstance(q, Query):
@@ -316,24 +515,53 @@ class DocElementAccessor:
     Describes an element in a document, at a given path.
     It can be "executed" on a document with :func:`_resolve_element`.
 
-    The attribute and dict-element accessors return new instances of :class:`DocElementAccessor`.
+    The attribute and dict-element accessors return new instances of :class:`DocElementAccessor`. These children are
+    cached on their parent as long as they are in use, so that accessing the same sub-element twice returns the same
+    object. The cache only holds weak references, so that accessing many different names does not grow it forever.
     """
 
-    __slots__ = ("_path",)
+    __slots__ = ("_path", "_children", "_hash", "_accessor", "_str", "__weakref__")
     _path: Tuple[str, ...]
+    _children: "Optional[Dict[str, ref[DocElementAccessor]]]"
+    _hash: Optional[int]
+    _accessor: Optional[Callable[[Metadata], Union[Metadata, NestedPrimitive]]]
+    _str: Optional[str]
 
     def __init__(self):
         self._path = ()
+        self._children = None
+        self._hash = None
+        self._accessor = None
+        self._str = None
 
     # def __hash__(self):
     #     return hash((type(self),) + self._path)
 
     def __getattr__(self: Q, item: str) -> Q:
-        """Subtarget accessor: Return a new `DocElementAccessor` whose path is `self._path + (item,)`"""
-        query = type(self)()
-        query._path = self._path + (item,)
+        """Subtarget accessor: Return a `DocElementAccessor` whose path is `self._path + (item,)`"""
+        if item[:2] == "__" and item[-2:] == "__":
+            # Special names are looked up by python protocols (copy, pickle...), they are never document elements.
+            raise AttributeError(item)
+
+        children = self._children
+        if children is None:
+            children = self._children = {}
+        child_ref = children.get(item)
+        query = None if child_ref is None else child_ref()
+        if query is None:
+            # intern the path elements so that dict lookups on documents using the same keys compare them by identity
+            item = sys.intern(item)
+            query = type(self)()
+            path = query._path = self._path + (item,)
+            # the path is fixed from now on: precompute the hash, as done by `hash_query`
+            query._hash = hash((type(query), path))
+            children[item] = ref(query, _child_remover(children, item))
         return query
 
+    def __reduce__(self):
+        # Only the path is pickled: the cached children, hash, accessor and string are rebuilt on demand once loaded
+        return _doc_element, (type(self), self._path)
+
     # this dual expression is a bad idea: we cant disambiguate the user intent when the actual target is e.g. list/dict.
     # Rather create a proper KnownFunction.
     # def __getitem__(self, item: str):
@@ -345,6 +573,25 @@ class DocElementAccessor:
     #         return super()
 
 
+def _child_remover(children: Dict[str, "ref[DocElementAccessor]"], name: str) -> Callable[["ref"], None]:
+    """Return the callback removing the weak reference to the child `name` from `children`, once this child is dead."""
+
+    def remove(child_ref):
+        # the child may have been recreated in the meantime
+        if children.get(name) is child_ref:
+            del children[name]
+
+    return remove
+
+
+def _doc_element(cls: Type[Q], path: Tuple[str, ...]) -> Q:
+    """Create the `DocElementAccessor` of type `cls` at `path`. Used to unpickle them."""
+    res = cls()
+    res._path = path = tuple(map(sys.intern, path))
+    res._hash = hash((cls, path))
+    return res
+
+
 def resolve_element(qt: DocElementAccessor, meta: Metadata) -> Union[Metadata, NestedPrimitive]:
     """Find and return this query target in the given document, or raise `MissingQueryTargetError` if not found.
 
@@ -369,20 +616,146 @@ def resolve_element(qt: DocElementAccessor, meta: Metadata) -> Union[Metadata, N
     MissingQueryTargetError
         When this query target can not be found on the given document.
     """
+    res = _get_accessor(qt)(meta)
+    if res is MISSING:
+        raise _missing_error(qt._path, meta)
+    return res
+
+
+def resolve_many(qt: DocElementAccessor, metas: Iterable[Metadata]) -> List[Union[Metadata, NestedPrimitive]]:
+    """Equivalent of ``[resolve_element(qt, meta) for meta in metas]``, with less overhead per document.
+
+    Parameters
+    ----------
+    qt : DocElementAccessor
+        The query target.
+    metas : Iterable[Metadata]
+        The documents on which to find this query target.
+
+    Returns
+    -------
+    results : List
+        The values of the query target in each of the ``metas`` documents.
+
+    Raises
+    ------
+    MissingQueryTargetError
+        When this query target can not be found on one of the given documents.
+    """
+    metas = list(metas)
+    res = list(map(_get_accessor(qt), metas))
+    for r, meta in zip(res, metas):
+        if r is MISSING:
+            raise _missing_error(qt._path, meta)
+    return res
+
+
+def to_soa(
+    metas: Iterable[Metadata], targets: Iterable[Union[DocElementAccessor, Tuple[str, ...]]]
+) -> Dict[Tuple[str, ...], List[Union[Metadata, NestedPrimitive]]]:
+    """Convert a sequence of documents into columns, one per query target ("structure of arrays" layout).
+
+    Each column contains the values of the query target in each of the ``metas`` documents, in the same order. This
+    layout is more efficient than the list of documents when the same few elements of many documents are needed,
+    for example to convert them to numpy arrays or dataframe columns.
+
+    Parameters
+    ----------
+    metas : Iterable[Metadata]
+        The documents to convert.
+    targets : Iterable[Union[DocElementAccessor, Tuple[str, ...]]]
+        The query targets to extract, either as queries (e.g. ``query_base().a.b``) or as paths (e.g. ``("a", "b")``).
+
+    Returns
+    -------
+    columns : Dict[Tuple[str, ...], List]
+        A dictionary containing for each target path the list of values of this target in the documents. When a
+        target can not be found in a document, the corresponding value is `MISSING`.
+    """
+    metas = metas if isinstance(metas, (list, tuple)) else list(metas)
+    columns = {}
+    for qt in targets:
+        if isinstance(qt, DocElementAccessor):
+            path = qt._path
+            accessor = _get_accessor(qt)
+        else:
+            path = tuple(qt)
+            accessor = _compile_accessor(path)
+        columns[path] = list(map(accessor, metas))
+    return columns
+
+
+def _get_accessor(qt: DocElementAccessor) -> Callable[[Metadata], Union[Metadata, NestedPrimitive]]:
+    """Return the function resolving `qt` in a document, or returning `MISSING` if it can not be found.
+
+    Returning a sentinel rather than raising `MissingQueryTargetError` avoids the cost of exceptions in evaluation
+    loops, where missing elements may be frequent. The function is generated once and cached on `qt`. It is also
+    shared with the other queries referring to the same path, e.g. ``query_base("a.b")`` and ``query_base().a.b``.
+    """
+    accessor = qt._accessor
+    if accessor is None:
+        path = qt._path
+        accessor = _ACCESSORS.get(path)
+        if accessor is None:
+            accessor = _ACCESSORS[path] = _compile_accessor(path)
+        qt._accessor = accessor
+    return accessor
+
+
+# The accessors generated by `_get_accessor` for each path, as long as they are used by a query
+_ACCESSORS: "WeakValueDictionary[Tuple[str, ...], Callable[[Metadata], Union[Metadata, NestedPrimitive]]]" = (
+    WeakValueDictionary()
+)
+
+
+def _compile_accessor(path: Tuple[str, ...]) -> Callable[[Metadata], Union[Metadata, NestedPrimitive]]:
+    """Generate a function returning the element at `path` in a document, e.g. ``meta['a']['b']``, or `MISSING`.
+
+    The chain of item accessors is generated as source code and compiled, so that there is no python-level loop
+    over the path elements when the function is called.
+    """
+    src = (
+        "def accessor(meta):\n"
+        "    try:\n"
+        f"        return {_accessor_expr(path)}\n"
+        "    except (KeyError, TypeError):\n"
+        "        return MISSING\n"
+    )
+    namespace = {"MISSING": MISSING}
+    exec(src, namespace)
+    return namespace["accessor"]
+
+
+def _accessor_expr(path: Tuple[str, ...]) -> str:
+    """Return the source code of the expression accessing `path` in a document named `meta`, e.g. ``meta['a']['b']``.
+
+    It raises KeyError or TypeError when the element is missing.
+    """
+    return "meta" + "".join(f"[{p!r}]" for p in path)
+
+
+def _missing_error(path: Tuple[str, ...], meta: Metadata) -> MissingQueryTargetError:
+    """Create the error raised when `path` can not be found in `meta`, with the path of the first missing element."""
     res = meta
-    for i, p in enumerate(qt._path):
+    for i, p in enumerate(path):
         try:
             res = res[p]  # type: ignore
         except (KeyError, TypeError):
-            raise MissingQueryTargetError(qt._path[0 : (i + 1)])
-    return res
+            return MissingQueryTargetError(path[0 : (i + 1)])
+    return MissingQueryTargetError(path)
 
 
 class DocElementQuery(DocElementAccessor, Query):
     """A query using a :class:`DocElementAccessor` for the evaluation."""
 
+    # no instance __dict__: the attributes are the slots of `DocElementAccessor`
+    __slots__ = ()
+
     def __str__(self):
-        return ".".join(("<metadata_root>",) + self._path)
+        res = self._str
+        if res is None:
+            res = self._str = ".".join(("<metadata_root>",) + self._path)
+        return res
 
     def __repr__(self):
         return f"{type(self).__name__}(_path={str(self)})"
@@ -393,12 +766,21 @@ class _Missing:
 
     __slots__ = ()
 
+    # Sort rank: MISSING < NEGATED_MISSING < any other object (whose rank is 0)
+    _rank = -2
+
     def __lt__(self, other):
         # Always appear smallest in comparisons for sorting, except with self
-        return other is not MISSING
+        return self._rank < getattr(type(other), "_rank", 0)
 
     def __gt__(self, other):
-        return False
+        return self._rank > getattr(type(other), "_rank", 0)
+
+    def __eq__(self, other):
+        return self is other
+
+    def __hash__(self):
+        return id(self)
 
     def __bool__(self):
         return False
@@ -415,12 +797,20 @@ class _NegatedMissing:
 
     __slots__ = ()
 
+    _rank = -1
+
     def __lt__(self, other):
         # Always appear smallest in comparisons, except compared with MISSING or self
-        return other is not MISSING and other is not NEGATED_MISSING
+        return self._rank < getattr(type(other), "_rank", 0)
 
     def __gt__(self, other):
-        return other is MISSING
+        return self._rank > getattr(type(other), "_rank", 0)
+
+    def __eq__(self, other):
+        return self is other
+
+    def __hash__(self):
+        return id(self)
 
     def __bool__(self):
         return True
@@ -449,17 +839,45 @@ class KnownFunction(Enum):
     ALL = "ALL"
     IS_IN = "IS_IN"
 
+    def __call__(self, *args) -> "FunctionQuery":
+        """Create a query applying this known function to `args`, e.g. ``KnownFunction.EXISTS(q)``."""
+        return FunctionQuery._make(self, args)
+
 
 class FunctionQuery(Query):
     """
     Represents a query using a known function in the :class:`KnownFunction` enum.
     """
 
-    __slots__ = ("function", "args")
+    __slots__ = ("function", "args", "_hash", "__weakref__")
 
     def __init__(self, function: KnownFunction, args: Tuple = ()):
         self.function = function
         self.args = args
+        self._hash = None
+
+    @staticmethod
+    def _make(function: KnownFunction, args: Tuple = ()) -> "FunctionQuery":
+        """Equivalent of ``FunctionQuery(function, args)``, without the overhead of `__init__`.
+
+        Since queries are immutable, the created query is memoized: calling `_make` again with the same function and
+        the same arguments returns the same object, as long as it is in use. Its hash is computed at creation.
+        """
+        key = (function, _args_key(args))
+        o = _FUNCTION_QUERIES.get(key)
+        if o is None:
+            o = FunctionQuery.__new__(FunctionQuery)
+            o.function = function
+            o.args = args
+            o._hash = None
+            try:
+                # compute the hash now: the hashes of the arguments built with `_make` are already known
+                o._hash = hash_query(o)
+            except (TypeError, NotImplementedError, InvalidQueryUsageError):
+                # unhashable argument (e.g. a dict, or a namedtuple of queries): `hash_query` will raise if ever called
+                pass
+            _FUNCTION_QUERIES[key] = o
+        return o
 
     def __str__(self):
         args_and_kwargs = ", ".join((str(a) for a in self.args))
@@ -470,14 +888,76 @@ class FunctionQuery(Query):
     def __repr__(self):
         return f"{type(self).__name__}(function={self.function}, args={self.args})"  # , kwargs={self.kwargs})"
 
+    def __reduce__(self):
+        # The cached hash is not pickled: str hashes differ from one process to another
+        return type(self), (self.function, self.args)
+
+
+# The queries created by `FunctionQuery._make`, as long as they are in use
+_FUNCTION_QUERIES: "WeakValueDictionary[Tuple, FunctionQuery]" = WeakValueDictionary()
+
+
+def _args_key(args: Tuple) -> Tuple:
+    """Return a hashable key identifying the arguments of a `FunctionQuery`, for `FunctionQuery._make`.
+
+    Queries and unhashable objects (including containers of queries, that can not be hashed) are identified by their
+    identity: they are kept alive by the memoized query, so the identity can not be reused by another object. Other
+    objects are identified by their type and value, so that e.g. ``1``, ``1.0`` and ``True`` are not confused.
+    """
+    keys = []
+    for arg in args:
+        arg_type = type(arg)
+        if arg_type is tuple:
+            keys.append((arg_type, _args_key(arg)))
+        elif arg_type is float:
+            # distinguish 0.0 from -0.0, and make nan equal to itself
+            keys.append((arg_type, arg.hex()))
+        elif isinstance(arg, Query):
+            keys.append((Query, id(arg)))
+        else:
+            try:
+                hash(arg)
+            except (TypeError, InvalidQueryUsageError):
+                # unhashable, or containing queries (e.g. a namedtuple)
+                keys.append((arg_type, id(arg), None))
+            else:
+                keys.append((arg_type, arg))
+    return tuple(keys)
+
+
+# Dispatch tables keyed on the exact query type, used by `maybe_parenthesis` and `hash_query` to avoid a cascade of
+# `isinstance` checks on each node. Subclasses are handled by the slow path in these functions.
+_STR_DISPATCH: Dict[type, Callable[[Any], str]] = {
+    OneSidedOperation: lambda q: f"({q})",
+    TwoSidedOperation: lambda q: f"({q})",
+    DocElementQuery: str,
+    FunctionQuery: str,
+}
+
+# For `hash_query`: (hash key of the node itself, children of the node, whether the hash can be cached on the node)
+_HASH_DISPATCH: Dict[type, Tuple[Callable[[Any], Tuple], Callable[[Any], Tuple], bool]] = {
+    OneSidedOperation: (lambda q: (OneSidedOperation, q.operator), lambda q: (q.target,), True),
+    TwoSidedOperation: (
+        lambda q: (TwoSidedOperation, q.operator),
+        lambda q: (q.left_hand_side, q.right_hand_side),
+        True,
+    ),
+    FunctionQuery: (lambda q: (FunctionQuery, q.function), lambda q: q.args, True),
+    DocElementQuery: (lambda q: (DocElementQuery, q._path), lambda q: (), True),
+    # containers (e.g. arguments of `ql.any`) may contain queries, that can not be hashed with hash()
+    tuple: (lambda c: (tuple,), lambda c: c, False),
+    list: (lambda c: (list,), lambda c: c, False),
+}
+
 
 def query_base(path: Optional[str] = None) -> DocElementQuery:
     """Utility function to create a query on a document.
 
     By default this query refers to the root of the document, that is, the whole document.
     An optional ``path`` can be provided to directly position the query to a specific element in the document.
-    Note that ``query_base("foo.bar")`` is strictly equivalent to ``query_base().foo.bar`` or
-    ``query_base()["foo"]["bar"]``.
+    Note that ``query_base("foo.bar")`` is equivalent to ``query_base().foo.bar``. Queries are immutable and cached:
+    calling ``query_base()`` or ``query_base("foo.bar")`` twice returns the same query object. The caches can be
+    cleared with ``query_base.cache_clear()``.
 
     Parameters
     ----------
@@ -489,35 +969,291 @@ def query_base(path: Optional[str] = None) -> DocElementQuery:
     query : DocElementQuery
         A query object
     """
+    if path is None:
+        return _query_root()
+    return _query_base_from_path(path)
+
+
+@lru_cache(maxsize=1)
+def _query_root() -> DocElementQuery:
+    """Create the query on the document root. Cached, so that its children (cached while in use) are shared."""
+    return DocElementQuery()
+
+
+@lru_cache(maxsize=1024)
+def _query_base_from_path(path: str) -> DocElementQuery:
+    """Create the query for `path` directly, without creating the intermediate queries."""
     res = DocElementQuery()
-    if path is not None:
-        for item in path.split("."):
-            res = res[item]
+    res._path = tuple(map(sys.intern, path.split(".")))
+    res._hash = hash((DocElementQuery, res._path))
     return res
 
 
+def _clear_query_base_cache() -> None:
+    """Clear the caches of `query_base`: next calls create new queries."""
+    _query_root.cache_clear()
+    _query_base_from_path.cache_clear()
+
+
+query_base.cache_clear = _clear_query_base_cache  # type: ignore[attr-defined]
+
+
 def is_same_query(q1: Query, q2: Query):
     """Return True if the two queries are the same (note that using the equality operator would create a new query)."""
-    return hash_query(q1) == hash_query(q2)
+    return q1 is q2 or (hash_query(q1) == hash_query(q2) and _is_same_structure(q1, q2))
+
+
+def _is_same_structure(q1: Any, q2: Any) -> bool:
+    """Compare two queries node by node. Used to rule out hash collisions, e.g. ``hash(-1) == hash(-2)``."""
+    to_compare = [(q1, q2)]
+    while to_compare:
+        a, b = to_compare.pop()
+        if a is b:
+            continue
+        a_type = type(a)
+        if a_type is not type(b):
+            return False
+        elif a_type is OneSidedOperation:
+            if a.operator is not b.operator:
+                return False
+            to_compare.append((a.target, b.target))
+        elif a_type is TwoSidedOperation:
+            if a.operator is not b.operator:
+                return False
+            to_compare.append((a.left_hand_side, b.left_hand_side))
+            to_compare.append((a.right_hand_side, b.right_hand_side))
+        elif a_type is FunctionQuery:
+            if a.function is not b.function:
+                return False
+            to_compare.append((a.args, b.args))
+        elif isinstance(a, DocElementQuery):
+            if a._path != b._path:
+                return False
+        elif a_type is tuple or a_type is list:
+            if len(a) != len(b):
+                return False
+            to_compare.extend(zip(a, b))
+        elif isinstance(a, Query):
+            raise NotImplementedError(a_type)
+        else:
+            try:
+                if not (a == b):
+                    return False
+            except Exception:
+                return False
+    return True
+
+
+def normalize_query(q: Any) -> Any:
+    """Return a query equivalent to `q`, where redundant evaluations have been removed.
+
+    The following rewrites are applied recursively:
+
+     - chains of ``&`` (resp. ``|``) are flattened, and consecutive duplicate terms are removed: ``a & a & b`` becomes
+       ``a & b``,
+     - a conjunct shared by the beginning of consecutive terms of a ``|`` is factored out:
+       ``(a & b) | (a & c)`` becomes ``a & (b | c)``, so that ``a`` is evaluated only once.
+
+    Note that terms are never reordered, since ``&`` and ``|`` are not commutative in this query language: they return
+    python-like values (not booleans) and handle missing elements differently on each side.
 
+    Parameters
+    ----------
+    q : Query
+        The query to normalize.
 
-def hash_query(q: Any) -> int:
-    """Equivalent of hash(q)."""
-    if isinstance(q, OneSidedOperation):
-        return hash((type(q), hash_query(q.operator), hash_query(q.target)))
-    elif isinstance(q, TwoSidedOperation):
-        return hash((type(q), hash_query(q.operator), hash_query(q.left_hand_side), hash_query(q.right_hand_side)))
-    elif isinstance(q, DocElementQuery):
-        return hash((type(q), q._path))
-    elif not isinstance(q, Query):
-        return hash(q)
+    Returns
+    -------
+    normalized_query : Query
+        A query returning the same result as `q` on any document. It is `q` itself if nothing could be simplified.
+    """
+    # The tree is traversed iteratively (post-order) so that deep queries do not hit the recursion limit.
+    # stack of (node, whether it is an argument of a `FunctionQuery`, its children if they have been visited already)
+    to_visit: List[Tuple[Any, bool, Optional[Sequence[Any]]]] = [(q, False, None)]
+    # stack of the nodes normalized so far
+    results: List[Any] = []
+    while to_visit:
+        node, is_arg, children = to_visit.pop()
+        if children is None:
+            children = _children_to_normalize(node, is_arg)
+            if children is None:
+                # leaf
+                results.append(node)
+            else:
+                # visit the node again once all its children have been normalized (in order)
+                to_visit.append((node, is_arg, children))
+                children_are_args = type(node) is FunctionQuery
+                to_visit.extend((c, children_are_args, None) for c in reversed(children))
+        else:
+            # the normalized children are on top of the stack
+            nb_children = len(children)
+            new_children = results[len(results) - nb_children :]
+            del results[len(results) - nb_children :]
+            results.append(_rebuild_normalized(node, children, new_children))
+
+    return results[0]
+
+
+def _children_to_normalize(node: Any, is_arg: bool) -> Optional[Sequence[Any]]:
+    """Return the children to normalize before `node` in `normalize_query`, or None if `node` is left as is.
+
+    The children of a chain of ``&`` (resp. ``|``) are its terms. The arguments of a `FunctionQuery` may be containers
+    of queries (e.g. for `ql.any`), whose children are their items.
+    """
+    node_type = type(node)
+    if node_type is TwoSidedOperation:
+        op = node.operator
+        if op is _AND or op is _OR:
+            return _flatten(node, op)
+        return node.left_hand_side, node.right_hand_side
+    elif node_type is OneSidedOperation:
+        return (node.target,)
+    elif node_type is FunctionQuery:
+        return node.args
+    elif is_arg and (node_type is tuple or node_type is list):
+        return node
+    else:
+        return None
+
+
+def _rebuild_normalized(node: Any, children: Sequence[Any], new_children: List[Any]) -> Any:
+    """Return `node` with its `children` replaced with their normalized version `new_children`, and normalized.
+
+    `node` itself is returned if nothing could be simplified.
+    """
+    node_type = type(node)
+    if node_type is TwoSidedOperation:
+        op = node.operator
+        if op is _AND or op is _OR:
+            new_terms = []
+            for term in new_children:
+                if not new_terms or not is_same_query(term, new_terms[-1]):
+                    new_terms.append(term)
+            if op is _OR:
+                new_terms = _factor_leading_conjuncts(new_terms)
+            if len(new_terms) == len(children) and all(n is t for n, t in zip(new_terms, children)):
+                return node
+            return _chain(op, new_terms)
+
+    if all(n is c for n, c in zip(new_children, children)):
+        return node
+    elif node_type is TwoSidedOperation:
+        return node.operator(*new_children)
+    elif node_type is OneSidedOperation:
+        return node.operator(new_children[0])
+    elif node_type is FunctionQuery:
+        return FunctionQuery._make(node.function, tuple(new_children))
     else:
-        raise NotImplementedError(type(q))
+        # container of queries, argument of a `FunctionQuery`
+        return node_type(new_children)
+
+
+def _flatten(q: Any, op: TwoSidedOperator) -> List[Any]:
+    """Return the list of terms in a chain of `op`, e.g. ``[a, b, c]`` for ``(a & b) & c`` or ``a & (b & c)``"""
+    terms = []
+    to_visit = [q]
+    while to_visit:
+        node = to_visit.pop()
+        if type(node) is TwoSidedOperation and node.operator is op:
+            to_visit.append(node.right_hand_side)
+            to_visit.append(node.left_hand_side)
+        else:
+            terms.append(node)
+    return terms
+
+
+def _chain(op: TwoSidedOperator, terms: List[Any]) -> Any:
+    """Inverse of `_flatten`: build ``(a & b) & c`` from ``[a, b, c]``, as python does for ``a & b & c``."""
+    res = terms[0]
+    for term in terms[1:]:
+        res = op(res, term)
+    return res
+
+
+def _factor_leading_conjuncts(or_terms: List[Any]) -> List[Any]:
+    """Transform ``[a & b, a & c, d]`` into ``[a & (b | c), d]``.
+
+    Note: only the leading conjunct can be factored out. ``(b & a) | (c & a)`` is not equivalent to ``(b | c) & a``,
+    for example when ``a`` and ``c`` are falsy the former returns ``c`` while the latter returns ``a``.
+    """
+    res = []
+    group: List[Tuple[Any, List[Any]]] = []  # (term, conjuncts) of consecutive terms sharing a leading conjunct
+
+    def _flush_group():
+        if len(group) == 1:
+            res.append(group[0][0])
+        elif len(group) > 1:
+            rest = normalize_query(_chain(_OR, [_chain(_AND, conjuncts[1:]) for _, conjuncts in group]))
+            res.append(_AND(group[0][1][0], rest))
+        group.clear()
+
+    for term in or_terms:
+        conjuncts = _flatten(term, _AND)
+        if len(conjuncts) > 1 and group and is_same_query(conjuncts[0], group[0][1][0]):
+            group.append((term, conjuncts))
+        else:
+            _flush_group()
+            if len(conjuncts) > 1:
+                group.append((term, conjuncts))
+            else:
+                res.append(term)
+    _flush_group()
+
+    return res
+
+
+def hash_query(q: Any) -> int:
+    """Equivalent of hash(q).
+
+    Query nodes are immutable, so the hash is computed once and cached on each node. The tree is traversed
+    iteratively (post-order) so that deep queries do not hit the recursion limit.
+    """
+    # stack of (node, children_done) to visit, and stack of the hashes computed so far
+    to_visit = [(q, False)]
+    hashes = []
+    while to_visit:
+        node, children_done = to_visit.pop()
+        node_type = type(node)
+        handlers = _HASH_DISPATCH.get(node_type)
+        if handlers is None:
+            # slow path
+            if isinstance(node, DocElementQuery):
+                handlers = (lambda n: (type(n), n._path), lambda n: (), True)
+            elif isinstance(node, Query):
+                raise NotImplementedError(node_type)
+            else:
+                hashes.append(hash(node))
+                continue
+
+        get_key, get_children, cache = handlers
+        if children_done:
+            # the hashes of the children are on top of the stack
+            nb_children = len(get_children(node))
+            if nb_children > 0:
+                h = hash(get_key(node) + tuple(hashes[-nb_children:]))
+                del hashes[-nb_children:]
+            else:
+                h = hash(get_key(node))
+            if cache:
+                node._hash = h
+            hashes.append(h)
+        else:
+            h = node._hash if cache else None
+            if h is not None:
+                hashes.append(h)
+            else:
+                # visit the node again once all its children have been visited (in order)
+                to_visit.append((node, True))
+                to_visit.extend((c, False) for c in reversed(get_children(node)))
+
+    return hashes[0]
 
 
 class SortingQuery:
     """
     A query + a sorting order (ascending or descending)
+
+    Note: this is not a ``NamedTuple`` on purpose: sort keys are compared and hashed by identity, and are not iterable.
     """
 
     __slots__ = ("query", "is_ascending")
@@ -533,9 +1269,9 @@ class SortingQuery:
 
 def Asc(q: Query):
     """Declare that sorting should be done in ascending order with respect to the outcome of query `q`."""
-    return SortingQuery(query=q, is_ascending=True)
+    return SortingQuery(q, True)
 
 
 def Desc(q: Query):
     """Declare that sorting should be done in descending order with respect to the outcome of query `q`."""
-    return SortingQuery(query=q, is_ascending=False)
+    return SortingQuery(q, False)
@@ -2,24 +2,41 @@
 #          + All contributors to <https://github.com/smarie/python-pydocquery>
 #
 # License: 3-clause BSD, <https://github.com/smarie/python-pydocquery/blob/master/LICENSE>
+import operator
 import re
-from typing import Any, Callable, Union
+import threading
+from functools import lru_cache, partial
+from types import CodeType
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Sized, Tuple, Union
 
 from .queries import (
+    MISSING,
+    NEGATED_MISSING,
     DocElementQuery,
     FunctionQuery,
     KnownFunction,
     Metadata,
-    MissingQueryTargetError,
     OneSidedOperation,
     OneSidedOperator,
     Query,
     SortingQuery,
     TwoSidedOperation,
     TwoSidedOperator,
-    resolve_element,
+    _accessor_expr,
+    _get_accessor,
 )
 
+if TYPE_CHECKING:
+    import numpy as np
+
+# Compiled queries do not raise `MissingQueryTargetError` when an element is missing in the document: instead they
+# return the `MISSING` singleton, or `NEGATED_MISSING` once negated by a NOT (~) operator. This avoids the cost of
+# raising and catching exceptions in evaluation loops, where missing elements may be frequent. Each compiled operator
+# and function below is therefore responsible for propagating these singletons, with the same semantics as before.
+#
+# The compiled sub-queries and other objects used by the evaluation functions are bound as default arguments (e.g.
+# ``def _eval(meta, _left=left)``) rather than captured in a closure, since local variables are faster to access.
+
 
 def evaluate_query(q: Query, metadata: Metadata) -> Any:
     """Evaluate a query on the given document.
@@ -42,10 +59,13 @@ def evaluate_query(q: Query, metadata: Metadata) -> Any:
     return compile_query(q)(metadata)
 
 
-def compile_query(q: Union[Query, "SortingQuery"]) -> Callable[[Metadata], Any]:
+def compile_query(q: Union[Query, "SortingQuery"]) -> "CompiledQuery":
     """
     Generate a function able to execute the query on a piece of :class:`Metadata`.
 
+    Compiled queries are cached: compiling the same query object again, or a query with the same structure as a query
+    compiled recently (for example because it was built again with the same expression), returns the same function.
+
     Parameters
     ----------
     q : Query
@@ -53,39 +73,289 @@ def compile_query(q: Union[Query, "SortingQuery"]) -> Callable[[Metadata], Any]:
 
     Returns
     -------
-    evaluation_func : Callable[[Metadata], Any]
-        A function that takes a metadata document as input, and returns the result of the query.
+    evaluation_func : CompiledQuery
+        A function that takes a metadata document as input, and returns the result of the query. See
+        :class:`CompiledQuery` for evaluating the query on many documents.
     """
     # accept top-level sorting queries
     if isinstance(q, SortingQuery):
         q = q.query
-    return _compile(q, enforce_type=True, catch_missing_exc=True)
 
+    if isinstance(q, Query):
+        # fast path: the same query object was compiled recently, no need to compute its key
+        return _compile_identical(_IdenticalQuery(q))
+    return CompiledQuery(_compile(q, enforce_type=True))
 
-def _compile(
-    q: Union[Query, Any], enforce_type: bool = False, catch_missing_exc: bool = False
-) -> Callable[[Metadata], Any]:
-    """Transform a query into a callable."""
 
+class CompiledQuery(partial):
+    """A compiled query, as returned by :func:`compile_query`.
+
+    Calling it on a document returns the result of the query on this document. It is a `functools.partial` of the
+    compiled function (with no arguments), so that calling it does not add a python call frame.
+    """
+
+    __slots__ = ()
+
+    def batch(self, metas: Iterable[Metadata]) -> List[Any]:
+        """Evaluate the query on each of the given documents.
+
+        Parameters
+        ----------
+        metas : Iterable[Metadata]
+            The documents on which to evaluate the query.
+
+        Returns
+        -------
+        results : List[Any]
+            The result of the query on each document, or :obj:`MISSING` or :obj:`NEGATED_MISSING`.
+        """
+        return list(map(self.func, metas))
+
+    def mask(self, metas: Iterable[Metadata]) -> "np.ndarray":
+        """Evaluate the query on each of the given documents, and return the truth values as a numpy array.
+
+        Note that :obj:`MISSING` is falsy and :obj:`NEGATED_MISSING` is truthy. This requires `numpy` to be installed.
+
+        Parameters
+        ----------
+        metas : Iterable[Metadata]
+            The documents on which to evaluate the query.
+
+        Returns
+        -------
+        mask : np.ndarray
+            A boolean array containing the truth value of the query result on each document.
+        """
+        import numpy as np
+
+        count = len(metas) if isinstance(metas, Sized) else -1
+        return np.fromiter(map(bool, map(self.func, metas)), dtype=bool, count=count)
+
+
+class _KeyedQuery:
+    """A query along with its canonical key, so that it can be used as a cache key (queries are not hashable)."""
+
+    __slots__ = ("key", "query", "_hash")
+
+    def __init__(self, key: Tuple, query: Query):
+        self.key = key
+        self.query = query
+        self._hash = hash(key)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+@lru_cache(maxsize=4096)
+def _compile_cached(kq: _KeyedQuery) -> CompiledQuery:
+    """Compile a query, caching the result according to its canonical key."""
+    return CompiledQuery(_compile(kq.query, enforce_type=True))
+
+
+class _IdenticalQuery:
+    """A query wrapped so that it can be used as a cache key, compared by identity.
+
+    The cache holds a reference to the query, so its identity can not be reused by another object while cached.
+    """
+
+    __slots__ = ("query",)
+
+    def __init__(self, query: Query):
+        self.query = query
+
+    def __hash__(self):
+        return id(self.query)
+
+    def __eq__(self, other):
+        return self.query is other.query
+
+
+@lru_cache(maxsize=1024)
+def _compile_identical(iq: _IdenticalQuery) -> CompiledQuery:
+    """Compile a query, caching the result according to its identity, then to its canonical key."""
+    q = iq.query
+    key = _canonical_key(q)
+    if key is None:
+        # not cacheable by structure
+        return CompiledQuery(_compile(q, enforce_type=True))
+    return _compile_cached(_KeyedQuery(key, q))
+
+
+def _canonical_key(q: Query) -> Optional[Tuple]:
+    """Return a hashable key representing the structure of `q`, or None if `q` can not be cached.
+
+    Two queries have the same key if and only if they compile into equivalent functions. Constants are represented
+    by their type and value, so that e.g. ``1``, ``1.0`` and ``True`` are not confused. Unhashable constants (e.g.
+    lists) are represented by their identity, since they could be modified after compilation. Queries containing
+    unknown query types (subclasses) can not be cached. The tree is traversed iteratively (post-order) so that deep
+    queries do not hit the recursion limit.
+    """
+    # stack of (node, children_done) to visit, and stack of the keys computed so far
+    to_visit = [(q, False)]
+    keys: List[Any] = []
+    while to_visit:
+        node, children_done = to_visit.pop()
+        node_type = type(node)
+        if node_type is DocElementQuery:
+            keys.append((node_type, node._path))
+            continue
+        elif node_type is OneSidedOperation:
+            head, children = (node_type, node.operator), (node.target,)
+        elif node_type is TwoSidedOperation:
+            head, children = (node_type, node.operator), (node.left_hand_side, node.right_hand_side)
+        elif node_type is FunctionQuery:
+            head, children = (node_type, node.function), node.args
+        elif node_type is tuple or (node_type is list and any(isinstance(c, Query) for c in node)):
+            # containers of queries (e.g. arguments of `ql.any`) are compiled item by item
+            head, children = (node_type,), node
+        elif isinstance(node, Query):
+            return None
+        else:
+            keys.append(_constant_key(node))
+            continue
+
+        if not children_done:
+            # visit the node again once all its children have been visited (in order)
+            to_visit.append((node, True))
+            to_visit.extend((c, False) for c in reversed(children))
+        elif len(children) > 0:
+            # the keys of the children are on top of the stack
+            nb_children = len(children)
+            k = head + tuple(keys[-nb_children:])
+            del keys[-nb_children:]
+            keys.append(k)
+        else:
+            keys.append(head)
+
+    return keys[0]
+
+
+def _constant_key(c: Any) -> Tuple:
+    """Return the key of a constant, for `_canonical_key`."""
+    c_type = type(c)
+    if c_type is float:
+        # distinguish 0.0 from -0.0, and make nan equal to itself
+        return c_type, c.hex()
+    try:
+        hash(c)
+    except TypeError:
+        return c_type, id(c), None
+    else:
+        return c_type, c
+
+
+def _compile(q: Union[Query, Any], enforce_type: bool = False) -> Callable[[Metadata], Any]:
+    """Transform a query into a callable.
+
+    Note that the callable does not need any top-level wrapper: missing elements are propagated as `MISSING` /
+    `NEGATED_MISSING`, that are directly the result of the query in that case.
+
+    The compilers of each node call `_compile` on their sub-queries. In order not to hit the recursion limit on deep
+    queries, the sub-queries that will be compiled separately are first listed iteratively, and compiled from the
+    leaves up: the compilation of each node then finds its sub-queries already compiled, in a memo.
+    """
+    memo = getattr(_compilation, "memo", None)
+    if memo is not None:
+        # we are compiling a node, this is one of its sub-queries
+        compiled = memo.get(id(q))
+        if compiled is not None:
+            return compiled
+        return _compile_node(q, enforce_type)
+
+    # top-level call
+    if enforce_type and not isinstance(q, Query):
+        raise TypeError(q)
+    memo = _compilation.memo = {}
+    try:
+        for unit in reversed(_compilation_units(q)):
+            if id(unit) not in memo:
+                memo[id(unit)] = _compile_node(unit)
+        return memo[id(q)]
+    finally:
+        _compilation.memo = None
+
+
+# The memo of the compilation in progress in the current thread, see `_compile`. Note that it is keyed by node id: this
+# is safe since the nodes are kept alive by the query being compiled.
+_compilation = threading.local()
+
+
+def _compilation_units(q: Any) -> List[Any]:
+    """List the nodes of `q` that are compiled separately (with `_compile`), parents before children.
+
+    These are all the nodes, except for the operators inlined in the code generated by `compile_fused_operators` and
+    `compile_fused_booleans` (as well as the document elements and constants they refer to), see `_generate_code`
+    and `_generate_boolean_expr`.
+    """
+    units = []
+    to_visit = [q]
+    while to_visit:
+        unit = to_visit.pop()
+        units.append(unit)
+        if _is_fusable(unit) and _is_worth_fusing(unit):
+            region = [(unit, 0)]
+            while region:
+                node, depth = region.pop()
+                for operand in _sub_queries(node):
+                    if depth + 1 < _MAX_FUSED_DEPTH and _is_fusable(operand):
+                        region.append((operand, depth + 1))
+                    elif not isinstance(operand, DocElementQuery):
+                        to_visit.append(operand)
+        elif _is_boolean(unit):
+            region = [(unit, 0)]
+            while region:
+                node, depth = region.pop()
+                for operand in _sub_queries(node):
+                    if type(operand) is TwoSidedOperation and operand.operator is node.operator:
+                        # same boolean operator: does not increase the nesting, see `_generate_boolean_expr`
+                        region.append((operand, depth))
+                    elif depth + 1 < _MAX_FUSED_DEPTH and _is_boolean(operand):
+                        region.append((operand, depth + 1))
+                    elif not isinstance(operand, DocElementQuery):
+                        to_visit.append(operand)
+        else:
+            to_visit.extend(_sub_queries(unit))
+    return units
+
+
+def _sub_queries(q: Any) -> List[Query]:
+    """Return the direct sub-queries of `q`, including the ones in containers such as the arguments of ANY/ALL."""
+    if isinstance(q, OneSidedOperation):
+        children = (q.target,)
+    elif isinstance(q, TwoSidedOperation):
+        children = (q.left_hand_side, q.right_hand_side)
+    elif isinstance(q, FunctionQuery):
+        children = []
+        for arg in q.args:
+            if type(arg) is tuple or type(arg) is list:
+                children.extend(arg)
+            else:
+                children.append(arg)
+    else:
+        return []
+    return [c for c in children if isinstance(c, Query)]
+
+
+def _compile_node(q: Union[Query, Any], enforce_type: bool = False) -> Callable[[Metadata], Any]:
+    """Transform a query node into a callable. Its sub-queries are compiled with `_compile`."""
+
+    # fast path: dispatch on the exact type of the node
+    compiler = _COMPILE_DISPATCH.get(type(q))
+    if compiler is not None:
+        return compiler(q)
+
+    # slow path: constants and subclasses of the query types
     if not isinstance(q, Query):
         if enforce_type:
             raise TypeError(q)
         else:
             # Return a "constant" function returning the object
             # TODO should we return a copy to ensure non-mutability ?
-            def _eval(meta: Metadata) -> Any:
-                return q
-
-    elif catch_missing_exc:
-        # Compile a non-catching version
-        _non_catching_eval = _compile(q, enforce_type=enforce_type, catch_missing_exc=False)
-
-        # Create a catching wrapper
-        def _eval(meta: Metadata) -> Any:
-            try:
-                return _non_catching_eval(meta)
-            except MissingQueryTargetError as e:
-                return e.to_object()
+            def _eval(meta: Metadata, _q=q) -> Any:
+                return _q
 
     elif isinstance(q, OneSidedOperation):
         _eval = compile_one_sided_operator(q.operator, q.target)  # type: ignore
@@ -97,9 +367,7 @@ def _compile(
         _eval = compile_known_function(q.function, q.args)  # type: ignore
 
     elif isinstance(q, DocElementQuery):
-        # Simply return the referenced element from the doc
-        def _eval(meta: Metadata) -> Any:
-            return resolve_element(q, meta)  # type: ignore
+        _eval = _get_accessor(q)
 
     else:
         raise NotImplementedError(type(q))
@@ -107,307 +375,899 @@ def _compile(
     return _eval
 
 
+def _compile_one_sided_operation(q: OneSidedOperation) -> Callable[[Metadata], Any]:
+    """Compile a `OneSidedOperation`, fusing it with its operands when possible."""
+    if _is_fusable(q) and _is_worth_fusing(q):
+        return compile_fused_operators(q)
+    return compile_one_sided_operator(q.operator, q.target)
+
+
+def _compile_two_sided_operation(q: TwoSidedOperation) -> Callable[[Metadata], Any]:
+    """Compile a `TwoSidedOperation`, fusing it with its operands when possible."""
+    if _is_fusable(q) and _is_worth_fusing(q):
+        return compile_fused_operators(q)
+    elif _is_boolean(q):
+        return compile_fused_booleans(q)
+    return compile_two_sided_operator(q.operator, q.left_hand_side, q.right_hand_side)
+
+
+def _compile_function_query(q: FunctionQuery) -> Callable[[Metadata], Any]:
+    """Compile a `FunctionQuery`."""
+    return compile_known_function(q.function, q.args)
+
+
+# The compiler used by `_compile` for each (exact) query type.
+# Note that for a `DocElementQuery`, the accessor generated for the element path (e.g. ``meta['a']['b']``, returning
+# MISSING if the element is not found) is directly used, without any wrapping closure.
+_COMPILE_DISPATCH: Dict[type, Callable[[Any], Callable[[Metadata], Any]]] = {
+    OneSidedOperation: _compile_one_sided_operation,
+    TwoSidedOperation: _compile_two_sided_operation,
+    FunctionQuery: _compile_function_query,
+    DocElementQuery: _get_accessor,
+}
+
+
+# Maximum depth of an operator tree fused into a single generated function. Deeper sub-trees are compiled separately,
+# so as to keep the generated functions (and the recursion in the code generator) reasonably small.
+_MAX_FUSED_DEPTH = 50
+
+
+def _is_fusable(q: Any) -> bool:
+    """Return True if `q` is an operator node that can be inlined in the code generated by `compile_fused_operators`.
+
+    Boolean operators are not fusable since they require a special handling of missing elements.
+    """
+    q_type = type(q)
+    if q_type is TwoSidedOperation:
+        return q.operator is not TwoSidedOperator.AND and q.operator is not TwoSidedOperator.OR  # type: ignore
+    elif q_type is OneSidedOperation:
+        return q.operator is not OneSidedOperator.NOT  # type: ignore
+    return False
+
+
+def _is_worth_fusing(q: Union[OneSidedOperation, TwoSidedOperation]) -> bool:
+    """Return True if generating code for the fusable operator `q` is worth it, see `compile_fused_operators`.
+
+    This is the case when an operand is another fusable operator, or a document element (its access is inlined).
+    Otherwise, the generated function would only call the same functions as the closures of
+    `compile_one_sided_operator` / `compile_two_sided_operator`, that are cheaper to create.
+    """
+    for operand in _sub_queries(q):
+        if isinstance(operand, DocElementQuery) or _is_fusable(operand):
+            return True
+    return False
+
+
+def compile_fused_operators(q: Union[OneSidedOperation, TwoSidedOperation]) -> Callable[[Metadata], Any]:
+    """Compile a tree of arithmetic and comparison operators into a single generated function.
+
+    For example ``(meta.a + 1) * meta.b < 5`` is compiled into the equivalent of
+
+    .. code-block:: python
+
+        def _eval(meta):
+            try:
+                _t0 = meta['a']
+            except (KeyError, TypeError):
+                return MISSING
+            _t1 = _t0 + _v1
+            try:
+                _t2 = meta['b']
+            except (KeyError, TypeError):
+                return MISSING
+            _t3 = _t1 * _t2
+            return _t3 < _v3
+
+    where the accesses to ``meta.a`` and ``meta.b`` are inlined as in their accessor (see `_get_accessor`), and
+    ``_v1`` and ``_v3`` are the constants. Each node is evaluated in the same order as with nested closures, but
+    without the python call overhead of one closure per operator node. The sub-queries that can not be inlined
+    (boolean operators, known functions) are compiled separately with :func:`_compile`, and called from the generated
+    function.
+    """
+    namespace: Dict[str, Any] = {"MISSING": MISSING, "NEGATED_MISSING": NEGATED_MISSING}
+    lines = ["def _eval(meta):"]
+    res = _generate_code(q, namespace, lines, depth=0)
+    lines.append(f"    return {res}")
+    exec(_compile_source("\n".join(lines)), namespace)
+    return namespace["_eval"]
+
+
+def _generate_code(q: Any, namespace: Dict[str, Any], lines: List[str], depth: int) -> str:
+    """Generate the code evaluating `q` on a document named `meta`, for `compile_fused_operators`.
+
+    The code is appended to `lines` and the returned string is the name of the variable containing the result (or
+    of the constant). The objects used in the code (constants, element accessors, compiled sub-queries) are stored
+    in `namespace`.
+    """
+    q_type = type(q)
+    if depth < _MAX_FUSED_DEPTH and _is_fusable(q):
+        if q_type is TwoSidedOperation:
+            lhs = _generate_code(q.left_hand_side, namespace, lines, depth + 1)
+            rhs = _generate_code(q.right_hand_side, namespace, lines, depth + 1)
+            res = f"_t{len(lines)}"
+            lines.append(f"    {res} = {lhs} {q.operator.value} {rhs}")
+        else:
+            target = _generate_code(q.target, namespace, lines, depth + 1)
+            res = f"_t{len(lines)}"
+            lines.append(f"    {res} = {q.operator.value}{target}")
+        return res
+
+    name = f"_v{len(namespace)}"
+    if isinstance(q, DocElementQuery):
+        # inline the code of the element accessor, and propagate the missing element
+        res = f"_t{len(lines)}"
+        lines.append("    try:")
+        lines.append(f"        {res} = {_accessor_expr(q._path)}")
+        lines.append("    except (KeyError, TypeError):")
+        lines.append("        return MISSING")
+        return res
+    elif isinstance(q, Query):
+        # compiled sub-queries may also return NEGATED_MISSING, propagate both
+        namespace[name] = _compile(q)
+        res = f"_t{len(lines)}"
+        lines.append(f"    {res} = {name}(meta)")
+        lines.append(f"    if {res} is MISSING or {res} is NEGATED_MISSING:")
+        lines.append(f"        return {res}")
+        return res
+    else:
+        namespace[name] = q
+        return name
+
+
+def _is_boolean(q: Any) -> bool:
+    """Return True if `q` is a boolean AND (&) or OR (|) node, that can be inlined by `compile_fused_booleans`."""
+    return type(q) is TwoSidedOperation and (
+        q.operator is TwoSidedOperator.AND or q.operator is TwoSidedOperator.OR  # type: ignore
+    )
+
+
+def compile_fused_booleans(q: TwoSidedOperation) -> Callable[[Metadata], Any]:
+    """Compile a tree of boolean AND (&) and OR (|) operators into a single generated function.
+
+    For example ``(meta.a > 1) & meta.b & (meta.c | ~meta.d)`` is compiled into the equivalent of
+
+    .. code-block:: python
+
+        def _eval(meta):
+            return _v0(meta) and _v1(meta) and (_v2(meta) or _v3(meta))
+
+    where ``_v0`` ... ``_v3`` are the compiled operands. Since MISSING is falsy and NEGATED_MISSING is truthy, python's
+    ``and`` and ``or`` have the same semantics as `_compile_and` and `_compile_or`, with the same short-circuits. Chains
+    of the same operator, such as ``a & b & c``, are written without parenthesis whatever their length: ``and`` and
+    ``or`` are associative, both in result and in evaluation order.
+    """
+    namespace: Dict[str, Any] = {}
+    expr = _generate_boolean_expr(q, namespace, depth=0)
+    exec(_compile_source(f"def _eval(meta):\n    return {expr}"), namespace)
+    return namespace["_eval"]
+
+
+def _generate_boolean_expr(q: TwoSidedOperation, namespace: Dict[str, Any], depth: int) -> str:
+    """Generate the expression evaluating the boolean operator `q` on a document named `meta`.
+
+    The chain of operands of the same operator as `q` is collected iteratively. An operand with the other boolean
+    operator is generated recursively within parenthesis, up to a nesting of `_MAX_FUSED_DEPTH`. The other operands
+    are compiled separately, and stored in `namespace` along with the constants.
+    """
+    op = q.operator
+    terms = []
+    # operands of the chain still to visit, the next one last
+    to_visit = [q.right_hand_side, q.left_hand_side]
+    while to_visit:
+        node = to_visit.pop()
+        if type(node) is TwoSidedOperation and node.operator is op:
+            to_visit.append(node.right_hand_side)
+            to_visit.append(node.left_hand_side)
+        elif depth + 1 < _MAX_FUSED_DEPTH and _is_boolean(node):
+            terms.append(f"({_generate_boolean_expr(node, namespace, depth + 1)})")
+        else:
+            name = f"_v{len(namespace)}"
+            if isinstance(node, DocElementQuery):
+                namespace[name] = _get_accessor(node)
+                terms.append(f"{name}(meta)")
+            elif isinstance(node, Query):
+                namespace[name] = _compile(node)
+                terms.append(f"{name}(meta)")
+            else:
+                namespace[name] = node
+                terms.append(name)
+    return f" {op.value} ".join(terms)
+
+
+@lru_cache(maxsize=1024)
+def _compile_source(src: str) -> CodeType:
+    """Compile generated source code. Queries with the same structure generate the same source, hence the cache."""
+    return compile(src, "<query>", "exec")
+
+
 def compile_one_sided_operator(op: OneSidedOperator, target: Any) -> Callable[[Metadata], Any]:
     """Compile a one-sided operator such as POS (+), NEG (-), NOT (~)."""
 
+    # when the target does not refer to the document, there is no missing element to propagate
+    can_miss = _can_miss(target)
+
     # compile target
     target = _compile(target)
 
-    # create the wrapping callable
-    def _eval(meta: Metadata) -> Any:
+    if not can_miss:
+        # create a lightweight callable
         if op is OneSidedOperator.NEG:
-            return -target(meta)
+            return lambda meta, _target=target: -_target(meta)
         elif op is OneSidedOperator.POS:
-            return +target(meta)
+            return lambda meta, _target=target: +_target(meta)
         elif op is OneSidedOperator.NOT:
-            try:
-                res = target(meta)
-            except MissingQueryTargetError as e:
-                # Switch the truth value of the error
-                e.negate()
-                raise e
+            return lambda meta, _target=target: not _target(meta)
+
+    # create the wrapping callable, specialized for the operator
+    if op is OneSidedOperator.NEG:
+
+        def _eval(meta: Metadata, _target=target) -> Any:
+            res = _target(meta)
+            if res is MISSING or res is NEGATED_MISSING:
+                return res
+            return -res
+
+    elif op is OneSidedOperator.POS:
+
+        def _eval(meta: Metadata, _target=target) -> Any:
+            res = _target(meta)
+            if res is MISSING or res is NEGATED_MISSING:
+                return res
+            return +res
+
+    elif op is OneSidedOperator.NOT:
+
+        def _eval(meta: Metadata, _target=target) -> Any:
+            res = _target(meta)
+            if res is MISSING:
+                # Switch the truth value of the missing element
+                return NEGATED_MISSING
+            elif res is NEGATED_MISSING:
+                return MISSING
             else:
                 # Important: since and/not/or can not be overridden, we use the bitwise operators &/~/| to perform the
                 # *boolean* logic. So implementation of & is 'and', implementation of | is 'or', and implementation of
                 # ~ is 'not'. Users really wishing to access bitwise operations should use ql.bin[and/not/or/xor].
                 return not res
-        else:
-            raise NotImplementedError()
+
+    else:
+        raise NotImplementedError(op)
 
     return _eval
 
 
+# The python function implementing each two-sided operator, except for the boolean AND and OR (see `_compile_and` and
+# `_compile_or`)
+_TWO_SIDED_FUNCTIONS: Dict[TwoSidedOperator, Callable[[Any, Any], Any]] = {
+    TwoSidedOperator.LT: operator.lt,
+    TwoSidedOperator.LE: operator.le,
+    TwoSidedOperator.EQ: operator.eq,
+    TwoSidedOperator.NE: operator.ne,
+    TwoSidedOperator.GT: operator.gt,
+    TwoSidedOperator.GE: operator.ge,
+    TwoSidedOperator.ADD: operator.add,
+    TwoSidedOperator.SUB: operator.sub,
+    TwoSidedOperator.MUL: operator.mul,
+    TwoSidedOperator.MATMUL: operator.matmul,
+    TwoSidedOperator.TRUEDIV: operator.truediv,
+    TwoSidedOperator.FLOORDIV: operator.floordiv,
+    TwoSidedOperator.MOD: operator.mod,
+    TwoSidedOperator.POW: operator.pow,
+    TwoSidedOperator.LSHIFT: operator.lshift,
+    TwoSidedOperator.RSHIFT: operator.rshift,
+}
+
+
 def compile_two_sided_operator(op: TwoSidedOperator, lhs: Any, rhs: Any) -> Callable[[Metadata], Any]:
-    """Compile a one-sided operator such as POS (+), NEG (-), NOT (~)."""
+    """Compile a two-sided operator such as LT (<), ADD (+), AND (&)."""
 
     # compile each side
     left = _compile(lhs)
     right = _compile(rhs)
 
+    # boolean operators have dedicated, short-circuiting, implementations
+    if op is TwoSidedOperator.AND:
+        return _compile_and(left, right)
+    elif op is TwoSidedOperator.OR:
+        return _compile_or(left, right)
+
+    # resolve the operator function once, at compile time
+    try:
+        op_fn = _TWO_SIDED_FUNCTIONS[op]
+    except KeyError:
+        raise NotImplementedError(op)
+
+    # constant sides do not need to be evaluated for each document
+    lhs_is_cst = _is_constant(lhs)
+    rhs_is_cst = _is_constant(rhs)
+    if lhs_is_cst and rhs_is_cst:
+        try:
+            value = op_fn(lhs, rhs)
+        except Exception:
+            # let the error happen at evaluation time, as usual
+            pass
+        else:
+            return lambda meta, _value=value: _value
+
+    elif rhs_is_cst:
+
+        def _eval(meta: Metadata, _left=left, _rhs=rhs, _op_fn=op_fn) -> Any:
+            left_res = _left(meta)
+            if left_res is MISSING or left_res is NEGATED_MISSING:
+                return left_res
+            return _op_fn(left_res, _rhs)
+
+        return _eval
+
+    elif lhs_is_cst:
+
+        def _eval(meta: Metadata, _lhs=lhs, _right=right, _op_fn=op_fn) -> Any:
+            right_res = _right(meta)
+            if right_res is MISSING or right_res is NEGATED_MISSING:
+                return right_res
+            return _op_fn(_lhs, right_res)
+
+        return _eval
+
     # create the wrapping callable
-    def _eval(meta: Metadata) -> Any:
-        # Note: execute left(meta) and right(meta) in line so that the operation is lazy when possible
-        if op is TwoSidedOperator.LT:
-            return left(meta) < right(meta)
-        elif op is TwoSidedOperator.LE:
-            return left(meta) <= right(meta)
-        elif op is TwoSidedOperator.EQ:
-            return left(meta) == right(meta)
-        elif op is TwoSidedOperator.NE:
-            return left(meta) != right(meta)
-        elif op is TwoSidedOperator.GT:
-            return left(meta) > right(meta)
-        elif op is TwoSidedOperator.GE:
-            return left(meta) >= right(meta)
-        elif op is TwoSidedOperator.ADD:
-            return left(meta) + right(meta)
-        elif op is TwoSidedOperator.SUB:
-            return left(meta) - right(meta)
-        elif op is TwoSidedOperator.MUL:
-            return left(meta) * right(meta)
-        elif op is TwoSidedOperator.MATMUL:
-            return left(meta) @ right(meta)
-        elif op is TwoSidedOperator.TRUEDIV:
-            return left(meta) / right(meta)
-        elif op is TwoSidedOperator.FLOORDIV:
-            return left(meta) // right(meta)
-        elif op is TwoSidedOperator.MOD:
-            return left(meta) % right(meta)
-        elif op is TwoSidedOperator.POW:
-            return left(meta) ** right(meta)
-        elif op is TwoSidedOperator.LSHIFT:
-            return left(meta) << right(meta)
-        elif op is TwoSidedOperator.RSHIFT:
-            return left(meta) >> right(meta)
-        elif op is TwoSidedOperator.AND:
-            # Important: since and/not/or can not be overridden, we use the bitwise operators &/~/| to perform the
-            # *boolean* logic. So implementation of & is 'and', implementation of | is 'or', and implementation of
-            # ~ is 'not'. Users really wishing to access bitwise operations should use ql.bin[and/not/or/xor].
-
-            # Note: the result may not be a boolean. See https://stackoverflow.com/a/68896273/7262247
-            try:
-                res = left(meta)
-                if not res:
-                    return res  # same behaviour as python: return the non-truthy object
-            except MissingQueryTargetError as e:
-                if not e:
-                    # only raise if the error is not negated, otherwise proceed
-                    raise
+    def _eval(meta: Metadata, _left=left, _right=right, _op_fn=op_fn) -> Any:
+        left_res = _left(meta)
+        if left_res is MISSING or left_res is NEGATED_MISSING:
+            return left_res
+        right_res = _right(meta)
+        if right_res is MISSING or right_res is NEGATED_MISSING:
+            return right_res
+        return _op_fn(left_res, right_res)
+
+    return _eval
 
-            return right(meta)
 
-        elif op is TwoSidedOperator.OR:
-            # Important: since and/not/or can not be overridden, we use the bitwise operators &/~/| to perform the
-            # *boolean* logic. So implementation of & is 'and', implementation of | is 'or', and implementation of
-            # ~ is 'not'. Users really wishing to access bitwise operations should use ql.bin[and/not/or/xor].
+def _can_miss(q: Any) -> bool:
+    """Return True if the evaluation of `q` may result in `MISSING` or `NEGATED_MISSING`.
 
-            # Special handling of missing here: accept that one side is missing
-            try:
-                # Is the left side here ? Evaluate
-                left_res = left(meta)
-            except MissingQueryTargetError as e:
-                # Left side is missing, use the error truth value and evaluate the right side alone
-                # Note: the result may not be a boolean. See https://stackoverflow.com/a/68896273/7262247
-                if e:
-                    # the error is negated, this is equivalent to true: raise
-                    raise
-                return bool(e) or right(meta)
-            else:
-                # Left side is here, catch any missing on the right side
-                # Note: the result may not be a boolean. See https://stackoverflow.com/a/68896273/7262247
-                return left_res or right(meta)
-        else:
-            raise NotImplementedError()
+    This is the case as soon as `q` refers to an element in the document. Unknown query types are assumed to be able
+    to miss. The tree is traversed iteratively so that deep queries do not hit the recursion limit.
+    """
+    to_visit = [q]
+    while to_visit:
+        node = to_visit.pop()
+        node_type = type(node)
+        if node_type is OneSidedOperation:
+            to_visit.append(node.target)
+        elif node_type is TwoSidedOperation:
+            to_visit.append(node.left_hand_side)
+            to_visit.append(node.right_hand_side)
+        elif node_type is FunctionQuery:
+            to_visit.extend(node.args)
+        elif node_type is tuple or node_type is list:
+            to_visit.extend(node)
+        elif isinstance(node, Query) or node is MISSING or node is NEGATED_MISSING:
+            # a document element, or an unknown query type, or a missing constant
+            return True
+    return False
+
+
+def _is_constant(obj: Any) -> bool:
+    """Return True if `obj` is a constant operand, that is neither a query nor a missing element singleton."""
+    return not isinstance(obj, Query) and obj is not MISSING and obj is not NEGATED_MISSING
+
+
+def _compile_and(left: Callable[[Metadata], Any], right: Callable[[Metadata], Any]) -> Callable[[Metadata], Any]:
+    """Compile the boolean AND (&) operator. The right side is not evaluated when the left side is falsy."""
+
+    # Important: since and/not/or can not be overridden, we use the bitwise operators &/~/| to perform the
+    # *boolean* logic. So implementation of & is 'and', implementation of | is 'or', and implementation of
+    # ~ is 'not'. Users really wishing to access bitwise operations should use ql.bin[and/not/or/xor].
+
+    # Note: MISSING is falsy and NEGATED_MISSING is truthy, so python's 'and' already has the expected behaviour:
+    # a missing left side is propagated, a negated missing left side lets the right side be evaluated.
+    def _eval(meta: Metadata, _left=left, _right=right) -> Any:
+        # Note: the result may not be a boolean. See https://stackoverflow.com/a/68896273/7262247
+        return _left(meta) and _right(meta)
+
+    return _eval
+
+
+def _compile_or(left: Callable[[Metadata], Any], right: Callable[[Metadata], Any]) -> Callable[[Metadata], Any]:
+    """Compile the boolean OR (|) operator. The right side is not evaluated when the left side is truthy."""
+
+    # Important: since and/not/or can not be overridden, we use the bitwise operators &/~/| to perform the
+    # *boolean* logic. So implementation of & is 'and', implementation of | is 'or', and implementation of
+    # ~ is 'not'. Users really wishing to access bitwise operations should use ql.bin[and/not/or/xor].
+
+    # Note: MISSING is falsy and NEGATED_MISSING is truthy, so python's 'or' already has the expected behaviour:
+    # a negated missing left side is propagated, a missing left side lets the right side be evaluated alone.
+    def _eval(meta: Metadata, _left=left, _right=right) -> Any:
+        # Note: the result may not be a boolean. See https://stackoverflow.com/a/68896273/7262247
+        return _left(meta) or _right(meta)
 
     return _eval
 
 
 def compile_known_function(kf: KnownFunction, args) -> Callable[[Metadata], Any]:
     """Compile a `KnownFunction`."""
+    try:
+        compiler = _KF_COMPILERS[kf]
+    except KeyError:
+        raise NotImplementedError(kf)
+    return compiler(args)
+
+
+def _compile_exists(args) -> Callable[[Metadata], Any]:
+    """Compile the EXISTS known function."""
+    target_elt: DocElementQuery = args[0]
+
+    if isinstance(target_elt, DocElementQuery):
+        # Generate the code of the element accessor (see `_get_accessor`), returning a boolean directly
+        src = (
+            "def _eval(meta):\n"
+            "    try:\n"
+            f"        {_accessor_expr(target_elt._path)}\n"
+            "    except (KeyError, TypeError):\n"
+            "        return False\n"
+            "    return True"
+        )
+        namespace: Dict[str, Any] = {}
+        exec(_compile_source(src), namespace)
+        return namespace["_eval"]
+
+    # Compile the query (do not use the higher-level compile here)
+    ctarget = _compile(target_elt)
+
+    def _eval(meta: Metadata, _ctarget=ctarget) -> Any:
+        res = _ctarget(meta)
+        return res is not MISSING and res is not NEGATED_MISSING
 
-    if kf is KnownFunction.EXISTS:
-        target_elt: DocElementQuery = args[0]
+    return _eval
 
-        # Compile the query (do not use the higher-level compile here)
-        ctarget = _compile(target_elt)
 
-        def _eval(meta: Metadata) -> Any:
-            try:
-                ctarget(meta)
-                return True
-            except MissingQueryTargetError:
-                return False
+def _compile_is_none(args) -> Callable[[Metadata], Any]:
+    """Compile the IS_NONE known function."""
+    target_elt: DocElementQuery = args[0]
+
+    # Compile the query (do not use the higher-level compile here)
+    ctarget = _compile(target_elt)
+
+    def _eval(meta: Metadata, _ctarget=ctarget) -> Any:
+        res = _ctarget(meta)
+        if res is MISSING or res is NEGATED_MISSING:
+            return res
+        return res is None
+
+    return _eval
+
 
-    elif kf is KnownFunction.IS_NONE:
-        target_elt: DocElementQuery = args[0]  # type: ignore
+def _compile_binnot(args) -> Callable[[Metadata], Any]:
+    """Compile the BINNOT known function."""
+    target_elt: Query = args[0]
 
-        # Compile the query (do not use the higher-level compile here)
-        ctarget = _compile(target_elt)
+    if type(target_elt) is FunctionQuery and target_elt.function is KnownFunction.BINNOT:
+        # ~~x is x for ints. Other results still go through both operators (e.g. ~~True is 1)
+        cinner = _compile(target_elt.args[0])
 
-        def _eval(meta: Metadata) -> Any:
-            return ctarget(meta) is None
+        def _eval(meta: Metadata, _cinner=cinner, _int=int) -> Any:
+            res = _cinner(meta)
+            if res is MISSING or res is NEGATED_MISSING or type(res) is _int:
+                return res
+            return ~~res
 
-    elif kf is KnownFunction.BINNOT:
-        target_elt: Query = args[0]  # type: ignore
+        return _eval
 
-        # Compile the query (do not use the higher-level compile here)
-        ctarget = _compile(target_elt)
+    # Compile the query (do not use the higher-level compile here)
+    ctarget = _compile(target_elt)
 
-        def _eval(meta: Metadata) -> Any:
-            return ~ctarget(meta)
+    def _eval(meta: Metadata, _ctarget=ctarget) -> Any:
+        res = _ctarget(meta)
+        if res is MISSING or res is NEGATED_MISSING:
+            return res
+        return ~res
+
+    return _eval
 
-    elif kf in (KnownFunction.BINAND, KnownFunction.BINOR, KnownFunction.BINXOR):
-        left_elt: Query
-        right_elt: Query
-        left_elt, right_elt = args  # type: ignore
 
-        # Compile the query (do not use the higher-level compile here)
-        cleft = _compile(left_elt)
+def _compile_bitwise(op_fn: Callable[[Any, Any], Any], args) -> Callable[[Metadata], Any]:
+    """Compile the BINAND, BINOR and BINXOR known functions, `op_fn` being the corresponding `operator` function.
+
+    These functions may have more than two arguments, the operator is then applied from left to right.
+    """
+    if len(args) != 2:
+        return _compile_bitwise_nary(op_fn, args)
+
+    left_elt, right_elt = args
+
+    # a constant side does not need to be evaluated for each document
+    if _is_constant(right_elt) and not _is_constant(left_elt):
+        return _compile_bitwise_rhs_constant(op_fn, left_elt, right_elt)
+    elif _is_constant(left_elt) and not _is_constant(right_elt):
         cright = _compile(right_elt)
 
-        if kf is KnownFunction.BINAND:
+        def _eval(meta: Metadata, _op_fn=op_fn, _lhs=left_elt, _cright=cright) -> Any:
+            right_res = _cright(meta)
+            if right_res is MISSING or right_res is NEGATED_MISSING:
+                return right_res
+            return _op_fn(_lhs, right_res)
 
-            def _eval(meta: Metadata) -> Any:
-                return cleft(meta) & cright(meta)
+        return _eval
 
-        elif kf is KnownFunction.BINOR:
+    # Compile the query (do not use the higher-level compile here)
+    cleft = _compile(left_elt)
+    cright = _compile(right_elt)
 
-            def _eval(meta: Metadata) -> Any:
-                return cleft(meta) | cright(meta)
+    def _eval(meta: Metadata, _op_fn=op_fn, _cleft=cleft, _cright=cright) -> Any:
+        left_res = _cleft(meta)
+        if left_res is MISSING or left_res is NEGATED_MISSING:
+            return left_res
+        right_res = _cright(meta)
+        if right_res is MISSING or right_res is NEGATED_MISSING:
+            return right_res
+        return _op_fn(left_res, right_res)
 
-        else:
-            # kf is KnownFunction.BINXOR:
-            def _eval(meta: Metadata) -> Any:
-                return cleft(meta) ^ cright(meta)
+    return _eval
 
-    elif kf is KnownFunction.MATCHES:
-        target: Query
-        regex: str
-        flags: int
-        target, regex, flags = args
 
-        # Compile the query (do not use the higher-level compile here)
-        ctarget = _compile(target)
+# For each bitwise operator, the int constant `c` such that `x <op> c` is `x` for any int `x`
+_BITWISE_IDENTITY = {operator.and_: -1, operator.or_: 0, operator.xor: 0}
+
+
+def _compile_bitwise_rhs_constant(
+    op_fn: Callable[[Any, Any], Any], left_elt: Any, rhs: Any
+) -> Callable[[Metadata], Any]:
+    """Compile a BINAND, BINOR or BINXOR known function whose right side is a constant, see `_compile_bitwise`.
+
+    When the constant is the identity of the operator (``x | 0``, ``x ^ 0``, ``x & -1``) or absorbs it (``x & 0``),
+    the operator is not applied to int results. Other results (e.g. bools, for which ``True | 0`` is ``1``) still go
+    through the operator, so that the result is always the same as ``op_fn(x, rhs)``.
+    """
+    cleft = _compile(left_elt)
 
-        # Compile the pattern if needed
-        cregex: re.Pattern = re.compile(regex, flags=flags)
+    if type(rhs) is int and rhs == _BITWISE_IDENTITY[op_fn]:
 
-        def _eval(meta: Metadata) -> Any:
-            res = ctarget(meta)
+        def _eval(meta: Metadata, _op_fn=op_fn, _cleft=cleft, _rhs=rhs, _int=int) -> Any:
+            left_res = _cleft(meta)
+            if left_res is MISSING or left_res is NEGATED_MISSING or type(left_res) is _int:
+                return left_res
+            return _op_fn(left_res, _rhs)
+
+    elif type(rhs) is int and rhs == 0 and op_fn is operator.and_:
+
+        def _eval(meta: Metadata, _op_fn=op_fn, _cleft=cleft, _rhs=rhs, _int=int) -> Any:
+            left_res = _cleft(meta)
+            if left_res is MISSING or left_res is NEGATED_MISSING:
+                return left_res
+            if type(left_res) is _int:
+                return 0
+            return _op_fn(left_res, _rhs)
+
+    else:
+
+        def _eval(meta: Metadata, _op_fn=op_fn, _cleft=cleft, _rhs=rhs) -> Any:
+            left_res = _cleft(meta)
+            if left_res is MISSING or left_res is NEGATED_MISSING:
+                return left_res
+            return _op_fn(left_res, _rhs)
+
+    return _eval
+
+
+def _compile_bitwise_nary(op_fn: Callable[[Any, Any], Any], args) -> Callable[[Metadata], Any]:
+    """Compile a BINAND, BINOR or BINXOR known function with more than two arguments, see `_compile_bitwise`."""
+    cfirst = _compile(args[0])
+    cothers = tuple(_compile(a) for a in args[1:])
+
+    def _eval(meta: Metadata, _op_fn=op_fn, _cfirst=cfirst, _cothers=cothers) -> Any:
+        res = _cfirst(meta)
+        if res is MISSING or res is NEGATED_MISSING:
+            return res
+        for c in _cothers:
+            other_res = c(meta)
+            if other_res is MISSING or other_res is NEGATED_MISSING:
+                return other_res
+            res = _op_fn(res, other_res)
+        return res
+
+    return _eval
+
+
+def _compile_matches(args) -> Callable[[Metadata], Any]:
+    """Compile the MATCHES known function.
+
+    Its arguments are the target and the pattern, already compiled with its flags by `matches`. An optional third
+    argument provides the flags of a pattern given as a string.
+    """
+    target: Query
+    regex: str
+    flags: int
+    target, regex = args[0], args[1]
+    flags = args[2] if len(args) > 2 else 0
+
+    # Compile the query (do not use the higher-level compile here)
+    ctarget = _compile(target)
+
+    # Compile the pattern if needed. Patterns compiled by `matches` may come from another regex engine (see
+    # `queries_lib._re_backend`), that also provides `search` and `pattern`: use them as is.
+    cregex: re.Pattern = re.compile(regex, flags=flags) if isinstance(regex, (str, bytes)) else regex
+    search = cregex.search
+
+    if isinstance(cregex.pattern, str):
+        # A str pattern can only search str targets: test the type rather than catching the TypeError
+        def _eval(meta: Metadata, _ctarget=ctarget, _search=search) -> Any:
+            res = _ctarget(meta)
+            if res is MISSING or res is NEGATED_MISSING:
+                return res
+            # The target is not a string, no-match
+            return isinstance(res, str) and _search(res) is not None
+
+    else:
+        # A bytes pattern can search any bytes-like target (buffer protocol), that can not be tested with isinstance
+        def _eval(meta: Metadata, _ctarget=ctarget, _search=search) -> Any:
+            res = _ctarget(meta)
+            if res is MISSING or res is NEGATED_MISSING:
+                return res
             try:
-                return cregex.search(res) is not None
+                return _search(res) is not None
             except TypeError:
-                # The target is not a string-like, no-match
+                # The target is not bytes-like, no-match
                 return False
 
-    elif kf is KnownFunction.IS_IN:
-        item, container = args
+    return _eval
+
+
+def _compile_is_in(args) -> Callable[[Metadata], Any]:
+    """Compile the IS_IN known function."""
+    item, container = args
 
-        # Compile both queries (do not use higher-level compile here)
-        c_container = _compile(container)
+    if type(container) is frozenset:
+        # A constant set of hashables, created by `is_in` from a list or tuple
         c_item = _compile(item)
 
-        def _eval(meta: Metadata) -> Any:
-            return c_item(meta) in c_container(meta)
+        def _eval(meta: Metadata, _c_item=c_item, _container=container) -> Any:
+            item_res = _c_item(meta)
+            if item_res is MISSING or item_res is NEGATED_MISSING:
+                return item_res
+            try:
+                return item_res in _container
+            except TypeError:
+                # unhashable item: it may still be equal to an element, as in the original list
+                for elt in _container:
+                    if elt is item_res or elt == item_res:
+                        return True
+                return False
 
-    elif kf is KnownFunction.ANY:
-        target = args[0]
-        if isinstance(target, Query):
-            # A single query returning an iterable. Compile it
-            ctarget = _compile(target)
+        return _eval
 
-            def _eval(meta: Metadata) -> Any:
-                res = ctarget(meta)
-                return any(res)
+    # Compile both queries (do not use higher-level compile here)
+    c_container = _compile(container)
+    c_item = _compile(item)
 
-        else:
-            # Target is an iterable
-            # -- special case of len = 0
-            if len(target) == 0:
-                # Return directly a function evaluating to False
-                return lambda meta: False
-
-            # -- compile each item in the iterable
-            cargs = tuple(_compile(a) for a in target)
-
-            # -- special missing handling, to be consistent with | operator
-            def _eval(meta: Metadata) -> Any:
-                all_missing: bool = True
-                # Execute all queries except the last one
-                for cf in cargs[:-1]:
-                    try:
-                        if cf(meta):
-                            # Early stopping: we found an actual True
-                            return True
-                        all_missing = False
-                    except MissingQueryTargetError as e:
-                        if e:
-                            # Early stopping: we found an actual True (a negated missing)
-                            return True
-                # final item
-                try:
-                    return bool(cargs[-1](meta))
-                except MissingQueryTargetError as e2:
-                    if e2:
-                        # Return: we found an actual True (a negated missing)
-                        return True
-                    if all_missing:
-                        # All previous queries were missing, this one too: raise the error.
-                        raise
-                    else:
-                        # At least one query was not missing, but none was True. Return False
-                        return False
-
-    elif kf is KnownFunction.ALL:
-        target = args[0]
-        if isinstance(target, Query):
-            # A single query returning an iterable. Compile it
-            ctarget = _compile(target)
-
-            def _eval(meta: Metadata) -> Any:
-                res = ctarget(meta)
-                return all(res)
+    def _eval(meta: Metadata, _c_item=c_item, _c_container=c_container) -> Any:
+        item_res = _c_item(meta)
+        if item_res is MISSING or item_res is NEGATED_MISSING:
+            return item_res
+        container_res = _c_container(meta)
+        if container_res is MISSING or container_res is NEGATED_MISSING:
+            return container_res
+        return item_res in container_res
 
-        else:
-            # Target is an iterable
-            # -- special case of len = 0
-            if len(target) == 0:
-                # Return directly a function evaluating to False
-                return lambda meta: False
-
-            # -- compile each item in the iterable
-            cargs = tuple(_compile(a) for a in target)
-
-            # -- special missing handling, to be consistent with & operator
-            def _eval(meta: Metadata) -> Any:
-                # Similar to "return all(c(meta) for c in cargs)" but with proper handling of missing
-                all_negated_missing = True
-                for c in cargs[:-1]:
-                    try:
-                        if not c(meta):
-                            # Early stopping: we found an actual False
-                            return False
-                        all_negated_missing = False
-                    except MissingQueryTargetError as e:
-                        if not e:
-                            # Early stopping: we found an actual False (a missing)
-                            raise e
-
-                # final item
-                try:
-                    return bool(cargs[-1](meta))
-                except MissingQueryTargetError as e2:
-                    if not e2:
-                        # Return: we found an actual False (a missing)
-                        raise e2
-                    elif all_negated_missing:
-                        # All previous queries were negated missing, this one too: raise the error.
-                        raise
-                    else:
-                        # All non-missing previous queries were True, but this one is missing. Return True
-                        return True
+    return _eval
 
-    else:
-        raise NotImplementedError(kf)
+
+def _compile_any(args) -> Callable[[Metadata], Any]:
+    """Compile the ANY known function."""
+    target = args[0]
+    if isinstance(target, Query):
+        # A single query returning an iterable. Compile it
+        ctarget = _compile(target)
+
+        def _eval(meta: Metadata, _ctarget=ctarget, _any=any) -> Any:
+            res = _ctarget(meta)
+            if res is MISSING or res is NEGATED_MISSING:
+                return res
+            return _any(res)
+
+        return _eval
+
+    # Target is an iterable
+    # -- special case of len = 0
+    if len(target) == 0:
+        # Return directly a function evaluating to False
+        return lambda meta: False
+
+    # -- compile each item in the iterable
+    cargs = tuple(_compile(a) for a in target)
+
+    # -- small iterables: generate a straight-line function
+    if len(cargs) <= _MAX_UNROLLED_ITEMS:
+        return _compile_unrolled_any(cargs)
+
+    # -- special missing handling, to be consistent with | operator
+    def _eval(meta: Metadata, _cargs=cargs, _bool=bool) -> Any:
+        all_missing: bool = True
+        # Execute all queries except the last one
+        for cf in _cargs[:-1]:
+            res = cf(meta)
+            if res is MISSING:
+                continue
+            if res:
+                # Early stopping: we found an actual True (possibly a negated missing)
+                return True
+            all_missing = False
+        # final item
+        res = _cargs[-1](meta)
+        if res is MISSING:
+            if all_missing:
+                # All previous queries were missing, this one too: propagate.
+                return res
+            else:
+                # At least one query was not missing, but none was True. Return False
+                return False
+        # Note: a negated missing is an actual True
+        return _bool(res)
+
+    return _eval
+
+
+def _compile_all(args) -> Callable[[Metadata], Any]:
+    """Compile the ALL known function."""
+    target = args[0]
+    if isinstance(target, Query):
+        # A single query returning an iterable. Compile it
+        ctarget = _compile(target)
+
+        def _eval(meta: Metadata, _ctarget=ctarget, _all=all) -> Any:
+            res = _ctarget(meta)
+            if res is MISSING or res is NEGATED_MISSING:
+                return res
+            return _all(res)
+
+        return _eval
+
+    # Target is an iterable
+    # -- special case of len = 0
+    if len(target) == 0:
+        # Return directly a function evaluating to False
+        return lambda meta: False
+
+    # -- compile each item in the iterable
+    cargs = tuple(_compile(a) for a in target)
+
+    # -- small iterables: generate a straight-line function
+    if len(cargs) <= _MAX_UNROLLED_ITEMS:
+        return _compile_unrolled_all(cargs)
+
+    # -- special missing handling, to be consistent with & operator
+    def _eval(meta: Metadata, _cargs=cargs, _bool=bool) -> Any:
+        # Similar to "return all(c(meta) for c in cargs)" but with proper handling of missing
+        all_negated_missing = True
+        for c in _cargs[:-1]:
+            res = c(meta)
+            if res is MISSING:
+                # Early stopping: we found an actual False (a missing)
+                return res
+            if res is NEGATED_MISSING:
+                continue
+            if not res:
+                # Early stopping: we found an actual False
+                return False
+            all_negated_missing = False
+
+        # final item
+        res = _cargs[-1](meta)
+        if res is MISSING:
+            # Return: we found an actual False (a missing)
+            return res
+        elif res is NEGATED_MISSING:
+            if all_negated_missing:
+                # All previous queries were negated missing, this one too: propagate.
+                return res
+            else:
+                # All non-missing previous queries were True, but this one is missing. Return True
+                return True
+        return _bool(res)
 
     return _eval
+
+
+# Maximum number of items of an ANY/ALL for which the loop over the items is unrolled in a generated function
+_MAX_UNROLLED_ITEMS = 32
+
+
+def _compile_unrolled_any(cargs: Tuple[Callable[[Metadata], Any], ...]) -> Callable[[Metadata], Any]:
+    """Generate the same function as the loop in `_compile_any`, unrolled. For example with two items:
+
+    .. code-block:: python
+
+        def _eval(meta):
+            all_missing = True
+            res = _c0(meta)
+            if res is not MISSING:
+                if res:
+                    return True
+                all_missing = False
+            res = _c1(meta)
+            if res is MISSING:
+                return res if all_missing else False
+            return _bool(res)
+    """
+    lines = ["def _eval(meta):", "    all_missing = True"]
+    for i in range(len(cargs) - 1):
+        lines += [
+            f"    res = _c{i}(meta)",
+            "    if res is not MISSING:",
+            "        if res:",
+            "            return True",
+            "        all_missing = False",
+        ]
+    lines += [
+        f"    res = _c{len(cargs) - 1}(meta)",
+        "    if res is MISSING:",
+        "        return res if all_missing else False",
+        "    return _bool(res)",
+    ]
+    namespace: Dict[str, Any] = {f"_c{i}": c for i, c in enumerate(cargs)}
+    namespace["MISSING"] = MISSING
+    namespace["_bool"] = bool
+    exec(_compile_source("\n".join(lines)), namespace)
+    return namespace["_eval"]
+
+
+def _compile_unrolled_all(cargs: Tuple[Callable[[Metadata], Any], ...]) -> Callable[[Metadata], Any]:
+    """Generate the same function as the loop in `_compile_all`, unrolled. For example with two items:
+
+    .. code-block:: python
+
+        def _eval(meta):
+            all_negated_missing = True
+            res = _c0(meta)
+            if res is MISSING:
+                return res
+            if res is not NEGATED_MISSING:
+                if not res:
+                    return False
+                all_negated_missing = False
+            res = _c1(meta)
+            if res is MISSING:
+                return res
+            if res is NEGATED_MISSING:
+                return res if all_negated_missing else True
+            return _bool(res)
+    """
+    lines = ["def _eval(meta):", "    all_negated_missing = True"]
+    for i in range(len(cargs) - 1):
+        lines += [
+            f"    res = _c{i}(meta)",
+            "    if res is MISSING:",
+            "        return res",
+            "    if res is not NEGATED_MISSING:",
+            "        if not res:",
+            "            return False",
+            "        all_negated_missing = False",
+        ]
+    lines += [
+        f"    res = _c{len(cargs) - 1}(meta)",
+        "    if res is MISSING:",
+        "        return res",
+        "    if res is NEGATED_MISSING:",
+        "        return res if all_negated_missing else True",
+        "    return _bool(res)",
+    ]
+    namespace: Dict[str, Any] = {f"_c{i}": c for i, c in enumerate(cargs)}
+    namespace["MISSING"] = MISSING
+    namespace["NEGATED_MISSING"] = NEGATED_MISSING
+    namespace["_bool"] = bool
+    exec(_compile_source("\n".join(lines)), namespace)
+    return namespace["_eval"]
+
+
+# The compiler of each known function, used by `compile_known_function`
+_KF_COMPILERS: Dict[KnownFunction, Callable[[Any], Callable[[Metadata], Any]]] = {
+    KnownFunction.EXISTS: _compile_exists,
+    KnownFunction.IS_NONE: _compile_is_none,
+    KnownFunction.BINNOT: _compile_binnot,
+    KnownFunction.BINAND: partial(_compile_bitwise, operator.and_),
+    KnownFunction.BINOR: partial(_compile_bitwise, operator.or_),
+    KnownFunction.BINXOR: partial(_compile_bitwise, operator.xor),
+    KnownFunction.MATCHES: _compile_matches,
+    KnownFunction.IS_IN: _compile_is_in,
+    KnownFunction.ANY: _compile_any,
+    KnownFunction.ALL: _compile_all,
+}
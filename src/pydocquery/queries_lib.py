@@ -2,12 +2,98 @@
 #          + All contributors to <https://github.com/smarie/python-pydocquery>
 #
 # License: 3-clause BSD, <https://github.com/smarie/python-pydocquery/blob/master/LICENSE>
+import os
 import re
-from typing import Any, Container, Iterable, Union
+import warnings
+from functools import lru_cache
+from typing import Any, Callable, Container, Iterable, TypeVar, Union
+
+from .queries import (
+    MISSING,
+    NEGATED_MISSING,
+    DocElementQuery,
+    FunctionQuery,
+    InvalidQueryUsageError,
+    KnownFunction,
+    OneSidedOperation,
+    Query,
+    TwoSidedOperation,
+)
+
+# The exact types of the queries. Checking `type(x) in _QUERY_TYPES` first is faster than `isinstance(x, Query)`,
+# that is only used as a fallback for subclasses.
+_QUERY_TYPES = (DocElementQuery, FunctionQuery, OneSidedOperation, TwoSidedOperation)
+_REGEX_TYPES = (str, re.Pattern)
+_ITEMS_TYPES = (list, tuple)
+
+# The regex engine used to compile the str patterns of `matches`. Setting the PYDOCQUERY_REGEX_BACKEND environment
+# variable to "re2" selects the linear-time google-re2 engine, if it is installed.
+_REGEX_BACKEND = os.environ.get("PYDOCQUERY_REGEX_BACKEND", "re")
+if _REGEX_BACKEND == "re2":
+    try:
+        import re2 as _re_backend
+    except ImportError:
+        warnings.warn("PYDOCQUERY_REGEX_BACKEND is 're2' but the re2 module is not installed, using 're' instead")
+        _re_backend = re
+elif _REGEX_BACKEND == "re":
+    _re_backend = re
+else:
+    warnings.warn(f"Invalid PYDOCQUERY_REGEX_BACKEND {_REGEX_BACKEND!r}, using 're' instead. Supported: 're', 're2'")
+    _re_backend = re
+
+# The factory of function queries, and the known functions, as module globals: loading a global is faster than the
+# attribute of a class.
+_make = FunctionQuery._make
+_F_EXISTS = KnownFunction.EXISTS
+_F_IS_NONE = KnownFunction.IS_NONE
+_F_BINNOT = KnownFunction.BINNOT
+_F_BINAND = KnownFunction.BINAND
+_F_BINOR = KnownFunction.BINOR
+_F_BINXOR = KnownFunction.BINXOR
+_F_MATCHES = KnownFunction.MATCHES
+_F_IS_IN = KnownFunction.IS_IN
+_F_ANY = KnownFunction.ANY
+_F_ALL = KnownFunction.ALL
+
+
+# The beginning of the "Examples" section of the docstrings of all the builders, that replaces {{EXAMPLES}}
+_EXAMPLES_HEADER = """Examples
+    --------
+
+    Prerequisite: import the various symbols, the functions library, and init the example.
+
+    >>> from se_model_manager import query_base, evaluate_query
+    >>> import se_model_manager.queries_lib as ql
+    >>> meta = query_base()"""
+
+T = TypeVar("T", bound=Callable)
+
+
+def _with_examples_header(f: T) -> T:
+    """Decorator inserting the common `_EXAMPLES_HEADER` in the docstring of `f`, in place of {{EXAMPLES}}."""
+    if f.__doc__ is not None:  # docstrings are removed with python -OO
+        f.__doc__ = f.__doc__.replace("{{EXAMPLES}}", _EXAMPLES_HEADER)
+    return f
+
+
+def _ensure_query(x: Any, name: str) -> None:
+    """Raise a TypeError if `x`, the argument named `name`, is not a query."""
+    if type(x) not in _QUERY_TYPES and not isinstance(x, Query):
+        raise TypeError(f"`{name}` must be a query")
+
 
-from .queries import DocElementQuery, FunctionQuery, KnownFunction, Query
+def _ensure_one_query(x: Any, y: Any, msg: str) -> None:
+    """Raise a TypeError with message `msg` if neither `x` nor `y` is a query."""
+    if (
+        type(x) not in _QUERY_TYPES
+        and type(y) not in _QUERY_TYPES
+        and not isinstance(x, Query)
+        and not isinstance(y, Query)
+    ):
+        raise TypeError(msg)
 
 
+@_with_examples_header
 def exists(target: DocElementQuery) -> FunctionQuery:
     """Test that a given element exists in the document.
 
@@ -16,14 +102,7 @@ def exists(target: DocElementQuery) -> FunctionQuery:
     target : DocElementQuery
         The query defining what should be tested for existence.
 
-    Examples
-    --------
-
-    Prerequisite: import the various symbols, the functions library, and init the example.
-
-    >>> from se_model_manager import query_base, evaluate_query
-    >>> import se_model_manager.queries_lib as ql
-    >>> meta = query_base()
+    {{EXAMPLES}}
     >>> metadata_example = {"a": {"b": 1, "c": None}}
 
     Basic usage:
@@ -41,13 +120,14 @@ def exists(target: DocElementQuery) -> FunctionQuery:
     >>> evaluate_query(ql.exists(meta.a.c), metadata_example)
     True
     """
-    if not isinstance(target, DocElementQuery):
+    if type(target) is not DocElementQuery and not isinstance(target, DocElementQuery):
         raise TypeError("The target of the exists() function must be a direct reference to an element in the document.")
 
-    return FunctionQuery(KnownFunction.EXISTS, args=(target,))
+    return _make(_F_EXISTS, (target,))
 
 
-def is_none(target: Query):
+@_with_examples_header
+def is_none(target: Query) -> FunctionQuery:
     """Test that a given element is none.
 
     Parameters
@@ -55,14 +135,7 @@ def is_none(target: Query):
     target : Query
         The query defining what should be tested for none.
 
-    Examples
-    --------
-
-    Prerequisite: import the various symbols, the functions library, and init the example.
-
-    >>> from se_model_manager import query_base, evaluate_query
-    >>> import se_model_manager.queries_lib as ql
-    >>> meta = query_base()
+    {{EXAMPLES}}
     >>> metadata_example = {"a": {"b": 1, "c": None}}
 
     Basic usage:
@@ -80,17 +153,17 @@ def is_none(target: Query):
     >>> evaluate_query(ql.is_none(~meta.missing), metadata_example)
     se_model_manager.NEGATED_MISSING
     """
-    if not isinstance(target, Query):
-        raise TypeError("`target` must be a query")
+    _ensure_query(target, "target")
 
-    return FunctionQuery(KnownFunction.IS_NONE, args=(target,))
+    return _make(_F_IS_NONE, (target,))
 
 
 # TODO add not_, or_, and_, xor_ so as to be able to document ~, | , & and ^ in doctests as we do below.
 #   Besides this could allow for optional parameters changing the way missings are handled.
 
 
-def binnot(target: Query):
+@_with_examples_header
+def binnot(target: Query) -> FunctionQuery:
     """The bitwise not ("invert") operator.
 
     Parameters
@@ -98,14 +171,7 @@ def binnot(target: Query):
     target : Query
         The query defining what should be inverted.
 
-    Examples
-    --------
-
-    Prerequisite: import the various symbols, the functions library, and init the example.
-
-    >>> from se_model_manager import query_base, evaluate_query
-    >>> import se_model_manager.queries_lib as ql
-    >>> meta = query_base()
+    {{EXAMPLES}}
     >>> metadata_example = {"a": {"b": 1, "c": None}, "e": False}
 
     Basic usage:
@@ -126,13 +192,13 @@ def binnot(target: Query):
     >>> evaluate_query(ql.binnot(~meta.d), metadata_example)
     se_model_manager.NEGATED_MISSING
     """
-    if not isinstance(target, Query):
-        raise TypeError("`target` must be a query")
+    _ensure_query(target, "target")
 
-    return FunctionQuery(KnownFunction.BINNOT, args=(target,))
+    return _make(_F_BINNOT, (target,))
 
 
-def binand(left: Query, right: Query):
+@_with_examples_header
+def binand(left: Query, right: Query) -> FunctionQuery:
     """The bitwise and operator.
 
     Parameters
@@ -142,14 +208,7 @@ def binand(left: Query, right: Query):
     right : Query
         The query defining the right term of the bitwise and.
 
-    Examples
-    --------
-
-    Prerequisite: import the various symbols, the functions library, and init the example.
-
-    >>> from se_model_manager import query_base, evaluate_query
-    >>> import se_model_manager.queries_lib as ql
-    >>> meta = query_base()
+    {{EXAMPLES}}
     >>> metadata_example = {"a": {"b": 12, "c": 25}, "e": False}
 
     Basic usage:
@@ -166,13 +225,13 @@ def binand(left: Query, right: Query):
     >>> evaluate_query(ql.binand(meta.e, ~(meta.missing > 12)), metadata_example)
     se_model_manager.NEGATED_MISSING
     """
-    if not isinstance(left, Query) and not isinstance(right, Query):
-        raise TypeError("At least one of `left` and `right` members must be a query")
+    _ensure_one_query(left, right, "At least one of `left` and `right` members must be a query")
 
-    return FunctionQuery(KnownFunction.BINAND, args=(left, right))
+    return _make(_F_BINAND, _bitwise_args(_F_BINAND, left, right))
 
 
-def binor(left: Query, right: Query):
+@_with_examples_header
+def binor(left: Query, right: Query) -> FunctionQuery:
     """The bitwise or operator.
 
     Parameters
@@ -182,14 +241,7 @@ def binor(left: Query, right: Query):
     right : Query
         The query defining the right term of the bitwise or.
 
-    Examples
-    --------
-
-    Prerequisite: import the various symbols, the functions library, and init the example.
-
-    >>> from se_model_manager import query_base, evaluate_query
-    >>> import se_model_manager.queries_lib as ql
-    >>> meta = query_base()
+    {{EXAMPLES}}
     >>> metadata_example = {"a": {"b": 12, "c": 25}, "e": False}
 
     Basic usage:
@@ -208,13 +260,13 @@ def binor(left: Query, right: Query):
     >>> evaluate_query(~ql.binor(meta.e, ~(meta.missing > 12)), metadata_example)
     se_model_manager.MISSING
     """
-    if not isinstance(left, Query) and not isinstance(right, Query):
-        raise TypeError("At least one of `left` and `right` members must be a query")
+    _ensure_one_query(left, right, "At least one of `left` and `right` members must be a query")
 
-    return FunctionQuery(KnownFunction.BINOR, args=(left, right))
+    return _make(_F_BINOR, _bitwise_args(_F_BINOR, left, right))
 
 
-def binxor(left: Query, right: Query):
+@_with_examples_header
+def binxor(left: Query, right: Query) -> FunctionQuery:
     """The bitwise xor operator.
 
     Parameters
@@ -224,14 +276,7 @@ def binxor(left: Query, right: Query):
     right : Query
         The query defining the right term of the bitwise xor.
 
-    Examples
-    --------
-
-    Prerequisite: import the various symbols, the functions library, and init the example.
-
-    >>> from se_model_manager import query_base, evaluate_query
-    >>> import se_model_manager.queries_lib as ql
-    >>> meta = query_base()
+    {{EXAMPLES}}
     >>> metadata_example = {"a": {"b": 156, "c": 52}, "e": False}
 
     Basic usage:
@@ -248,16 +293,32 @@ def binxor(left: Query, right: Query):
     >>> evaluate_query(ql.binxor(meta.e, ~(meta.missing > 12)), metadata_example)
     se_model_manager.NEGATED_MISSING
     """
-    if not isinstance(left, Query) and not isinstance(right, Query):
-        raise TypeError("At least one of `left` and `right` members must be a query")
+    _ensure_one_query(left, right, "At least one of `left` and `right` members must be a query")
+
+    return _make(_F_BINXOR, _bitwise_args(_F_BINXOR, left, right))
+
+
+def _bitwise_args(function: KnownFunction, left: Any, right: Any) -> tuple:
+    """Return the arguments of a BINAND, BINOR or BINXOR query on `left` and `right`.
 
-    return FunctionQuery(KnownFunction.BINXOR, args=(left, right))
+    When `left` is itself a query with the same known function, its arguments are spliced in, so that
+    ``binand(binand(a, b), c)`` is the flat ``BINAND(a, b, c)``, evaluated from left to right. `right` is not
+    spliced in: ``a & (b & c)`` evaluates ``c`` before applying the first operator, so that a missing ``c`` takes
+    precedence over an error in ``a & b``.
+    """
+    if type(left) is FunctionQuery and left.function is function:
+        return left.args + (right,)
+    return (left, right)
 
 
+@_with_examples_header
 def matches(target: Query, regex: Union[str, re.Pattern], flags: int = 0) -> FunctionQuery:
     """
     Test that a string-representing query matches the given regex.
 
+    The pattern is compiled with the python `re` module by default. Set the ``PYDOCQUERY_REGEX_BACKEND`` environment
+    variable to ``"re2"`` to compile str patterns with the google-re2 engine instead, that searches in linear time.
+
     Parameters
     ----------
     target : Query
@@ -269,14 +330,7 @@ def matches(target: Query, regex: Union[str, re.Pattern], flags: int = 0) -> Fun
     flags : int
         Regex flags to pass to ``re.match``.
 
-    Examples
-    --------
-
-    Prerequisite: import the various symbols, the functions library, and init the example.
-
-    >>> from se_model_manager import query_base, evaluate_query
-    >>> import se_model_manager.queries_lib as ql
-    >>> meta = query_base()
+    {{EXAMPLES}}
     >>> metadata_example = {"a": {"b": 1, "c": None}, "text": "hello", "text2": "2"}
 
     Basic usage:
@@ -326,16 +380,48 @@ def matches(target: Query, regex: Union[str, re.Pattern], flags: int = 0) -> Fun
     >>> evaluate_query(~ql.matches(meta.missing, r'^h[l_]+o'), metadata_example)
     se_model_manager.NEGATED_MISSING
     """
-    if not isinstance(target, Query):
-        raise TypeError("`target` must be a query")
-    if not isinstance(regex, (str, re.Pattern)):
-        raise TypeError("`regex` must be a string or re.Pattern")
-    if not isinstance(flags, int):
+    _ensure_query(target, "target")
+    try:
+        regex_handler = _REGEX_HANDLERS[type(regex)]
+    except KeyError:
+        if not isinstance(regex, _REGEX_TYPES):
+            raise TypeError("`regex` must be a string or re.Pattern")
+        regex_handler = _compile_regex
+    if type(flags) is not int and not isinstance(flags, int):
         raise TypeError("`flags` must be an int")
 
-    return FunctionQuery(KnownFunction.MATCHES, args=(target, regex, flags))
+    # compile the pattern once, when the query is created. Its flags are embedded in the compiled pattern.
+    return _make(_F_MATCHES, (target, regex_handler(regex, flags)))
+
+
+@lru_cache(maxsize=512)
+def _compile_regex(regex: Union[str, re.Pattern], flags: int) -> re.Pattern:
+    """Compile a regex pattern. Cached so that building the same query several times reuses the same pattern.
+
+    The pattern is compiled with the engine selected with PYDOCQUERY_REGEX_BACKEND. Patterns that this engine does
+    not support (e.g. backreferences for re2) are compiled with `re`, as well as patterns with flags: the `re` flags
+    do not translate to the options of re2.
+    """
+    if _re_backend is not re and not flags:
+        try:
+            return _re_backend.compile(regex)
+        except _re_backend.error:
+            pass
+    return re.compile(regex, flags)
 
 
+def _use_pattern(regex: re.Pattern, flags: int) -> re.Pattern:
+    """Return an already compiled pattern as is. As with `re.compile`, flags can not be added to it."""
+    if flags:
+        raise ValueError("cannot process flags argument with a compiled pattern")
+    return regex
+
+
+# The function returning the compiled pattern for each exact type of `regex` in `matches`
+_REGEX_HANDLERS = {str: _compile_regex, re.Pattern: _use_pattern}
+
+
+@_with_examples_header
 def is_in(item: Union[Any, Query], collection: Union[Container, Query]) -> FunctionQuery:
     """
     Test that an item is present in a collection.
@@ -346,16 +432,10 @@ def is_in(item: Union[Any, Query], collection: Union[Container, Query]) -> Funct
         The item to search for in the collection.
 
     collection : Union[Container, Query]
-        The collection inside which the item should be searched for.
+        The collection inside which the item should be searched for. A list or tuple of hashable elements is turned
+        into a frozenset when the query is created, so that membership is tested in constant time.
 
-    Examples
-    --------
-
-    Prerequisite: import the various symbols, the functions library, and init the example.
-
-    >>> from se_model_manager import query_base, evaluate_query
-    >>> import se_model_manager.queries_lib as ql
-    >>> meta = query_base()
+    {{EXAMPLES}}
     >>> metadata_example = {"a": {"b": 1, "c": None}, "text": "hello", "key": "c"}
 
     Basic usage when the container is a string
@@ -387,13 +467,20 @@ def is_in(item: Union[Any, Query], collection: Union[Container, Query]) -> Funct
     >>> evaluate_query(ql.is_in(meta.missing, meta.text), metadata_example)
     se_model_manager.MISSING
     """
-    if not isinstance(collection, Query) and not isinstance(item, Query):
-        raise TypeError("At least one of `collection` and `item` must be a query")
+    _ensure_one_query(collection, item, "At least one of `collection` and `item` must be a query")
+
+    if type(collection) in _ITEMS_TYPES:
+        try:
+            collection = frozenset(collection)
+        except (TypeError, InvalidQueryUsageError):
+            # unhashable elements (e.g. queries): keep the linear search
+            pass
 
-    return FunctionQuery(KnownFunction.IS_IN, args=(item, collection))
+    return _make(_F_IS_IN, (item, collection))
 
 
-def any(target: Union[Query, Iterable[Query]]):
+@_with_examples_header
+def any(target: Union[Query, Iterable[Query]]) -> FunctionQuery:
     """Test that any of the elements in the query, or any of the queries, is True.
 
     Note that `any((q1, q2))` slightly differs from `q1 | q2` in the sense that it always returns a boolean even in case
@@ -404,18 +491,12 @@ def any(target: Union[Query, Iterable[Query]]):
     ----------
     target : Union[Query, Iterable[Query]]
         If a single query is passed, the element returned by resolving the query will serve as a target for the any().
-        If an iterable is passed, each query will be resolved in turn in a lazy fashion, and the first True result
-        will result in a True output (False will be returned otherwise). If all queries refer to missing entries,
+        If an iterable is passed, it is materialized into a tuple when the query is created, so that it can be a
+        generator. Each query will be resolved in turn in a lazy fashion, and the first True result will result in a
+        True output (False will be returned otherwise). If all queries refer to missing entries,
         a :exc:`MissingQueryTargetError` is raised.
 
-    Examples
-    --------
-
-    Prerequisite: import the various symbols, the functions library, and init the example.
-
-    >>> from se_model_manager import query_base, evaluate_query
-    >>> import se_model_manager.queries_lib as ql
-    >>> meta = query_base()
+    {{EXAMPLES}}
     >>> metadata_example = {"a": {"b": 1, "c": None}, "items": [False, None]}
 
     Basic usage:
@@ -450,13 +531,18 @@ def any(target: Union[Query, Iterable[Query]]):
     se_model_manager.MISSING
 
     """
-    if not isinstance(target, Iterable) and not isinstance(target, Query):
-        raise TypeError("`target` must be an iterable or a query")
+    if type(target) not in _QUERY_TYPES and not isinstance(target, Query):
+        try:
+            items = iter(target)
+        except TypeError:
+            raise TypeError("`target` must be an iterable or a query") from None
+        target = _fold_items(_F_ANY, items)
 
-    return FunctionQuery(KnownFunction.ANY, args=(target,))
+    return _make(_F_ANY, (target,))
 
 
-def all(target: Union[Query, Iterable[Query]]):
+@_with_examples_header
+def all(target: Union[Query, Iterable[Query]]) -> FunctionQuery:
     """Test that all of the elements in the query, or all of the queries, is True.
 
     Note that `all((q1, q2))` slightly differs from `q1 & q2` in the sense that it always returns a boolean even in case
@@ -467,18 +553,12 @@ def all(target: Union[Query, Iterable[Query]]):
     ----------
     target : Union[Query, Iterable[Query]]
         If a single query is passed, the element returned by resolving the query will serve as a target for the all().
-        If an iterable is passed, each query will be resolved in turn in a lazy fashion, and the first False result
-        will result in a False output (True will be returned otherwise). If all queries refer to missing entries,
+        If an iterable is passed, it is materialized into a tuple when the query is created, so that it can be a
+        generator. Each query will be resolved in turn in a lazy fashion, and the first False result will result in a
+        False output (True will be returned otherwise). If all queries refer to missing entries,
         a :exc:`MissingQueryTargetError` is raised.
 
-    Examples
-    --------
-
-    Prerequisite: import the various symbols, the functions library, and init the example.
-
-    >>> from se_model_manager import query_base, evaluate_query
-    >>> import se_model_manager.queries_lib as ql
-    >>> meta = query_base()
+    {{EXAMPLES}}
     >>> metadata_example = {"a": {"b": 1, "c": False}, "items": [2, True]}
 
     Basic usage:
@@ -514,10 +594,60 @@ def all(target: Union[Query, Iterable[Query]]):
     se_model_manager.MISSING
 
     """
-    if not isinstance(target, Iterable) and not isinstance(target, Query):
-        raise TypeError("`target` must be an iterable or a query")
+    if type(target) not in _QUERY_TYPES and not isinstance(target, Query):
+        try:
+            items = iter(target)
+        except TypeError:
+            raise TypeError("`target` must be an iterable or a query") from None
+        target = _fold_items(_F_ALL, items)
+
+    return _make(_F_ALL, (target,))
+
 
-    return FunctionQuery(KnownFunction.ALL, args=(target,))
+def _fold_items(function: KnownFunction, items: Iterable) -> tuple:
+    """Materialize the items of an ANY/ALL known function into a tuple, simplified without changing its evaluation.
+
+    For ANY, a truthy constant item is "dominating": evaluation never goes further, so the items after it are
+    dropped. Falsy constant items are "neutral": they are all replaced with a single ``False`` at the end, that still
+    prevents the result from being a missing. ALL is symmetric. Nested ANY in ANY (resp. ALL in ALL) are flattened.
+    """
+    dominating = function is _F_ANY
+    folded = []
+    has_neutral = False
+    for item in items:
+        if type(item) is FunctionQuery and item.function is function and not isinstance(item.args[0], Query):
+            # nested ANY in ANY (resp. ALL in ALL). Its own items are already folded.
+            sub_items = item.args[0]
+            if len(sub_items) == 0:
+                # an empty ANY/ALL evaluates to False
+                sub_items = (False,)
+        else:
+            sub_items = (item,)
+
+        for sub_item in sub_items:
+            if (
+                type(sub_item) in _QUERY_TYPES
+                or isinstance(sub_item, Query)
+                or sub_item is MISSING
+                or sub_item is NEGATED_MISSING
+            ):
+                folded.append(sub_item)
+                continue
+            try:
+                truth = bool(sub_item)
+            except Exception:
+                # leave the error to evaluation time
+                folded.append(sub_item)
+                continue
+            if truth is dominating:
+                # evaluation always stops here
+                folded.append(truth)
+                return tuple(folded)
+            has_neutral = True
+
+    if has_neutral:
+        folded.append(not dominating)
+    return tuple(folded)
 
 
 # TODO
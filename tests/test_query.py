@@ -1,22 +1,73 @@
+import inspect
+import operator
+import os
+import pickle
+import re
+import subprocess
+import sys
+from collections import namedtuple
+
 import pytest
 
+import pydocquery.queries_compilation
 import pydocquery.queries_lib as ql
 from pydocquery import (
+    Asc,
+    Desc,
     MISSING,
     InvalidQueryUsageError,
     MissingQueryTargetError,
     Query,
     compile_query,
     evaluate_query,
+    hash_query,
+    is_same_query,
+    normalize_query,
     query_base,
     NEGATED_MISSING,
 )
-from pydocquery.queries import FunctionQuery, resolve_element
+from pydocquery.queries import (
+    FunctionQuery,
+    KnownFunction,
+    OneSidedOperator,
+    TwoSidedOperator,
+    _get_accessor,
+    resolve_element,
+    resolve_many,
+    to_soa,
+)
+
+
+# A namedtuple, used as a hashable container of queries
+NT = namedtuple("NT", "x y")
+
+# The python functions of the operators tested on queries
+BIN_OPS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+    "//": operator.floordiv,
+    "%": operator.mod,
+    "**": operator.pow,
+    "<<": operator.lshift,
+    ">>": operator.rshift,
+}
+UN_OPS = {"+": operator.pos, "-": operator.neg}
+
+
+# Shared by the tests, that must not modify it
+_SIMPLE_METADATA = {"a": {"b": 1, "c": True}, "d": "hello"}
 
 
 def get_simple_metadata():
-    metadata = {"a": {"b": 1, "c": True}, "d": "hello"}
-    return metadata
+    return _SIMPLE_METADATA
 
 
 @pytest.mark.parametrize("find", [resolve_element, evaluate_query])
@@ -33,6 +84,8 @@ def test_query_target_find(find):
     assert find(model.a.b, metadata) == 1
     assert find(model.a.c, metadata) is True
     assert find(model.d, metadata) == "hello"
+    assert find(query_base("a.b"), metadata) == 1
+    assert query_base("a.b") is query_base("a.b")
 
     # These are equivalent expressions
     # assert is_same_query(model["a"].b, model.a.b)
@@ -44,10 +97,238 @@ def test_query_target_find(find):
     if find is resolve_element:
         with pytest.raises(MissingQueryTargetError):
             find(model.e, metadata)
+        with pytest.raises(MissingQueryTargetError) as exc_info:
+            find(model.a.e.f, metadata)
+        assert exc_info.value.missingpath == ("a", "e")
     elif find is evaluate_query:
         assert find(model.e, metadata) is MISSING
 
 
+def test_resolve_many():
+    """Test that `resolve_many` works as expected"""
+
+    model = query_base()
+    docs = [{"a": {"b": 1}}, {"a": {"b": "hello"}}]
+
+    assert resolve_many(model.a.b, docs) == [1, "hello"]
+    assert resolve_many(model, docs) == docs
+    with pytest.raises(MissingQueryTargetError):
+        resolve_many(model.a.c, docs)
+
+
+def test_to_soa():
+    """Test the conversion of documents to columns"""
+
+    metas = [{"a": 1, "b": {"c": 2}}, {"a": 3}]
+    meta = query_base()
+    assert to_soa(metas, (meta.a, ("b", "c"))) == {("a",): [1, 3], ("b", "c"): [2, MISSING]}
+    assert to_soa(iter(metas), ()) == {}
+
+
+def test_query_target_cache():
+    """Test that accessing the same sub-element twice returns the same object"""
+
+    model = query_base()
+
+    assert model.a is model.a
+    assert model.a.b is model.a.b
+    assert model.a.b is not model.a.c
+    assert is_same_query(model.a.b, model.a.b)
+
+    # queries referring to the same path share the same accessor
+    assert query_base("a.b") is not model.a.b
+    assert _get_accessor(query_base("a.b")) is _get_accessor(model.a.b)
+
+    # element queries have no instance dict
+    assert not hasattr(model.a, "__dict__")
+
+    # the root is cached too
+    assert query_base() is model
+    assert query_base().a.b is model.a.b
+
+    # children that are not used anymore are not kept in the cache
+    for i in range(1000):
+        getattr(model, f"field_{i}")
+    assert len(model._children) < 10
+    query_base.cache_clear()
+    assert query_base() is not model
+
+
+def test_pickle_evaluated_query():
+    """Test that queries can be pickled after their evaluation, that caches generated functions on them"""
+
+    meta = query_base()
+    q = meta.x & meta.z
+    assert evaluate_query(q, {"x": 1, "z": 2}) == 2
+    assert resolve_element(meta.x, {"x": 1}) == 1
+
+    for query in (meta.x, meta, q):
+        loaded = pickle.loads(pickle.dumps(query))
+        assert is_same_query(loaded, query)
+    assert evaluate_query(pickle.loads(pickle.dumps(q)), {"x": 1, "z": 2}) == 2
+
+    # the cached hashes are not pickled, since they differ from one process to another: simulate it
+    q = ql.exists(meta.a.b) | (-meta.a.b > 1)
+    hash_query(q)
+    for node in (q, q.left_hand_side, q.right_hand_side, q.right_hand_side.left_hand_side, meta.a.b):
+        node._hash = 12345
+    loaded = pickle.loads(pickle.dumps(q))
+    query_base.cache_clear()
+    meta = query_base()
+    assert is_same_query(loaded, ql.exists(meta.a.b) | (-meta.a.b > 1))
+    assert is_same_query(loaded.right_hand_side.left_hand_side.target, meta.a.b)
+
+
+def test_sorting_query():
+    """Test that sort keys are compared and hashed by identity"""
+
+    meta = query_base()
+    asc_a = Asc(meta.a)
+    assert asc_a.query is meta.a and asc_a.is_ascending and not asc_a.is_descending
+    assert Desc(meta.b).is_descending
+    assert asc_a == asc_a
+    assert asc_a != Desc(meta.b)
+    assert asc_a != Asc(meta.a)
+    assert hash(asc_a) == hash(asc_a)
+    assert {asc_a, asc_a} == {asc_a}
+    assert asc_a not in [Desc(meta.b)]
+    with pytest.raises(TypeError):
+        iter(asc_a)
+
+
+def test_operators_lookup():
+    """Test that the operator classes can be iterated, and their operators looked up by value or name, as enums"""
+
+    assert len(OneSidedOperator) == 3
+    assert [op.name for op in OneSidedOperator] == ["NEG", "POS", "NOT"]
+    assert list(TwoSidedOperator)[0] is TwoSidedOperator.LT
+    assert len(list(TwoSidedOperator)) == len(TwoSidedOperator) == 18
+    assert TwoSidedOperator("<") is TwoSidedOperator["LT"] is TwoSidedOperator(TwoSidedOperator.LT)
+    assert OneSidedOperator("-") is OneSidedOperator.NEG
+    assert TwoSidedOperator("-") is TwoSidedOperator.SUB
+    assert TwoSidedOperator.AND in TwoSidedOperator
+    assert OneSidedOperator.NOT not in TwoSidedOperator
+    assert dict(TwoSidedOperator.__members__)["GE"] is TwoSidedOperator.GE
+    with pytest.raises(ValueError):
+        TwoSidedOperator("~")
+    with pytest.raises(KeyError):
+        TwoSidedOperator["NOT"]
+
+
+def test_builders_signature():
+    """Test that the builders of the functions library do not expose private parameters"""
+
+    builders = (ql.exists, ql.is_none, ql.binnot, ql.binand, ql.binor, ql.binxor, ql.matches, ql.is_in, ql.any, ql.all)
+    for builder in builders:
+        assert not any(p.startswith("_") for p in inspect.signature(builder).parameters)
+
+
+def test_known_function_call():
+    """Test that known functions can be called to create a `FunctionQuery`"""
+
+    meta = query_base()
+    q = KnownFunction.EXISTS(meta.a)
+    assert type(q) is FunctionQuery
+    assert q.function is KnownFunction.EXISTS
+    assert q.args == (meta.a,)
+    assert is_same_query(q, ql.exists(meta.a))
+
+
+def test_function_query_memoization():
+    """Test that building the same function query twice returns the same (immutable) object"""
+
+    meta = query_base()
+    assert ql.exists(meta.a) is ql.exists(meta.a)
+    assert ql.exists(meta.a) is not ql.exists(meta.b)
+    assert ql.binand(meta.a, 1) is ql.binand(meta.a, 1)
+    assert ql.binand(meta.a, 1) is not ql.binand(meta.a, True)
+    assert ql.binand(meta.a, 0.0) is not ql.binand(meta.a, -0.0)
+
+    # unhashable arguments are compared by identity
+    dct = {1: 2}
+    assert ql.is_in(meta.a, dct) is ql.is_in(meta.a, dct)
+    assert ql.is_in(meta.a, dct) is not ql.is_in(meta.a, {1: 2})
+
+    # hashable collections are turned into frozensets
+    assert ql.is_in(meta.a, [1, 2]) is ql.is_in(meta.a, (2, 1))
+    assert evaluate_query(ql.is_in(meta.a, [1, 2]), {"a": 2.0}) is True
+
+    # containers of queries can not be hashed: they are compared by identity
+    nt = NT(1, meta.b)
+    assert ql.is_in(meta.a, nt) is ql.is_in(meta.a, nt)
+    assert ql.is_in(meta.a, nt) is not ql.is_in(meta.a, NT(1, meta.b))
+
+    # collections containing queries are kept as is
+    lst = [meta.b]
+    assert ql.is_in(meta.a, lst).args[1] is lst
+    assert ql.is_in(meta.a, (1, meta.b)) is ql.is_in(meta.a, (1, meta.b))
+    assert evaluate_query(ql.is_in(meta.a, [1, 2]), {"a": [1]}) is False
+
+    # the items of any/all are materialized into a tuple
+    assert ql.any([meta.a, meta.b]) is ql.any(q for q in (meta.a, meta.b))
+
+
+def test_bitwise_flattening():
+    """Test that nested bitwise functions of the same kind are flattened into a single n-ary query"""
+
+    meta = query_base()
+    q = ql.binor(ql.binor(ql.binor(meta.a, 2), meta.b), 8)
+    assert tuple(map(id, q.args)) == tuple(map(id, (meta.a, 2, meta.b, 8)))
+    assert evaluate_query(q, {"a": 1, "b": 4}) == 15
+    assert evaluate_query(q, {"a": 1}) is MISSING
+    assert evaluate_query(ql.binxor(ql.binxor(ql.binand(meta.a, 3), meta.b), 1), {"a": 7, "b": 4}) == 6
+
+
+@pytest.mark.parametrize("value", [6, True, None, MISSING], ids=repr)
+def test_bitwise_constant(value):
+    """Test that the simplified bitwise functions (identity or absorbing constant, ~~) behave as the python operators"""
+
+    meta = query_base()
+    metadata = {} if value is MISSING else {"a": value}
+    for query, op, cst in (
+        (ql.binor(meta.a, 0), operator.or_, 0),
+        (ql.binxor(meta.a, 0), operator.xor, 0),
+        (ql.binand(meta.a, -1), operator.and_, -1),
+        (ql.binand(meta.a, 0), operator.and_, 0),
+        (ql.binor(0, meta.a), lambda a, b: b | a, 0),
+        (ql.binnot(ql.binnot(meta.a)), lambda a, b: ~~a, None),
+    ):
+        if value is MISSING:
+            assert evaluate_query(query, metadata) is MISSING
+        elif value is None:
+            with pytest.raises(TypeError):
+                evaluate_query(query, metadata)
+        else:
+            res = evaluate_query(query, metadata)
+            assert res == op(value, cst) and type(res) is type(op(value, cst))
+
+
+def test_hash_query():
+    """Test that `hash_query` works on all kind of queries, and caches the result"""
+
+    meta = query_base()
+
+    for q in (meta.a, meta.a > 1, ~meta.a, ql.exists(meta.a), ql.any([meta.a, meta.b < 2])):
+        h = hash_query(q)
+        assert q._hash == h
+        assert hash_query(q) == h
+
+    # the hash of document elements and function queries is known as soon as they are created
+    assert meta.c.d._hash is not None
+    assert ql.binnot(meta.c.d < 2)._hash is not None
+    assert ql.is_in(meta.a, {1: 2})._hash is None
+    assert hash_query(query_base("c.d")) == hash_query(meta.c.d)
+
+    assert is_same_query(ql.any([meta.a, meta.b < 2]), ql.any([meta.a, meta.b < 2]))
+    assert not is_same_query(ql.any([meta.a, meta.b < 2]), ql.any([meta.a, meta.b < 3]))
+
+    # deep queries do not hit the recursion limit
+    q = meta.a
+    for _ in range(5000):
+        q = q + 1
+    assert hash_query(q) == hash_query(q)
+
+
 def test_identity_query():
     metadata = get_simple_metadata()
     model = query_base()
@@ -85,11 +366,10 @@ def test_identity_query():
 )
 def test_query_two_sided_op(op_enum, op_str, stdlib_action, rop_enum, rop_str):
     """"""
-    metadata = {"a": {"b": 1, "c": True}, "d": "hello"}
+    metadata = get_simple_metadata()
     model = query_base()
 
-    def op_fun(x, y):
-        return eval(f"x {op_str} y")
+    op_fun = BIN_OPS[op_str]
 
     # do "model.d [<,>,==,!=,...] 'foo'"
     q1 = op_fun(model.a.b, 12)
@@ -121,8 +401,7 @@ def test_query_two_sided_op(op_enum, op_str, stdlib_action, rop_enum, rop_str):
 
     elif stdlib_action == "complement":
         # Python replaces the operation with the complement
-        def rop_fun(x, y):
-            return eval(f"x {rop_str} y")
+        rop_fun = BIN_OPS[rop_str]
 
         q2r = rop_fun(model.a.b, 42)
 
@@ -193,31 +472,6 @@ def test_boolean_and():
     assert evaluate_query(meta.e & 25, metadata) == 25
 
 
-def test_boolean_and():
-    metadata = {"a": {"b": 1, "c": True}, "d": "hello", "e": 12}
-    meta = query_base()
-
-    q1 = meta.a.c & meta.d
-    assert (
-        repr(q1)
-        == "<TwoSidedOperator.AND: 'and'>(DocElementQuery(_path=<metadata_root>.a.c), DocElementQuery(_path=<metadata_root>.d))"
-    )
-    assert str(q1) == "<metadata_root>.a.c and <metadata_root>.d"
-    assert (
-        evaluate_query(q1, metadata) == "hello"
-    )  # Strange but normal, see https://stackoverflow.com/a/68896273/7262247
-    # False-resolving
-    assert evaluate_query(None & meta.a.b, metadata) is None
-    assert evaluate_query(meta.d & None, metadata) is None
-    # Missing
-    assert evaluate_query(meta.missing & meta.d, metadata) is MISSING
-    assert evaluate_query(meta.d & meta.missing, metadata) is MISSING
-    # This is not the bitwise operation
-    assert 12 & 25 == 8
-    assert 12 and 25 == 25
-    assert evaluate_query(meta.e & 25, metadata) == 25
-
-
 def test_boolean_or():
     metadata = {"a": {"b": 1, "c": False}, "d": "hello", "e": 12}
     meta = query_base()
@@ -246,8 +500,10 @@ def test_boolean_or():
 
 def test_boolean_xor():
     meta = query_base()
-    with pytest.raises(InvalidQueryUsageError):
+    with pytest.raises(InvalidQueryUsageError, match="boolean xor operator does not exist"):
         meta.a ^ 12
+    with pytest.raises(InvalidQueryUsageError, match="boolean xor operator does not exist"):
+        12 ^ meta.a
 
 
 @pytest.mark.parametrize(
@@ -259,11 +515,10 @@ def test_boolean_xor():
 )
 def test_query_one_sided_op(op_enum, op_str):
 
-    metadata = {"a": {"b": 1, "c": True}, "d": "hello"}
+    metadata = get_simple_metadata()
     model = query_base()
 
-    def op_fun(x):
-        return eval(f"{op_str} x")
+    op_fun = UN_OPS[op_str]
 
     # do "[+, -, ~...] model.d"
     q1 = op_fun(model.a.b)
@@ -329,6 +584,8 @@ def test_query_known_functions_exists():
     assert evaluate_query(ql.exists(meta.a), metadata) is True
     assert evaluate_query(ql.exists(meta.a.unknown), metadata) is False
     assert evaluate_query(ql.exists(meta.unknown), metadata) is False
+    assert evaluate_query(ql.exists(meta.d.unknown), metadata) is False
+    assert evaluate_query(~ql.exists(meta.unknown), metadata) is True
 
     with pytest.raises(TypeError):
         ql.exists((meta.a > 1))
@@ -391,3 +648,195 @@ def test_query_negated_missing():
     # same thing as in python: any() is not strictly equivalent to chained 'or'
     assert evaluate_query(ql.any((~(meta.score > 12), False)), {}) is True
     assert evaluate_query(ql.any((False, ~(meta.score > 12))), {}) is True
+
+
+def test_normalize_query():
+    """Test that `normalize_query` simplifies queries without changing their results"""
+
+    meta = query_base()
+    a, b, c, d = meta.a > 0, meta.b, meta.c, meta.d
+
+    q = (a & b) | (a & c) | d
+    nq = normalize_query(q)
+    assert is_same_query(nq, (a & (b | c)) | d)
+
+    assert is_same_query(normalize_query(a & a & b), a & b)
+    assert is_same_query(normalize_query(ql.any([a & a])), ql.any([a]))
+    assert is_same_query(normalize_query(~((meta.x == -1) & (meta.x == -2))), ~((meta.x == -1) & (meta.x == -2)))
+
+    # nothing to simplify: the same query is returned
+    q2 = (b & a) | (c & a)
+    assert normalize_query(q2) is q2
+
+    # results are the same, including with missing elements
+    for doc in ({}, {"a": 1}, {"a": 0, "b": 2}, {"a": 1, "b": 0, "c": "x"}, {"a": 1, "b": False, "d": 3}, {"c": 1}):
+        assert evaluate_query(nq, doc) == evaluate_query(q, doc)
+        assert evaluate_query(~nq, doc) == evaluate_query(~q, doc)
+
+    # deep queries do not hit the recursion limit
+    deep = meta.a
+    for _ in range(5000):
+        deep = deep + 1
+    assert normalize_query(deep) is deep
+    deep_with_dup = ql.any([-deep & (a & a), b])
+    assert is_same_query(normalize_query(deep_with_dup), ql.any([-deep & a, b]))
+
+
+def test_fused_operators():
+    """Test that trees of arithmetic/comparison operators, compiled in a single function, work as expected"""
+
+    meta = query_base()
+    metadata = {"a": 2, "b": 3, "c": True}
+
+    assert evaluate_query((meta.a + 1) * meta.b < 10, metadata) is True
+    assert evaluate_query(-(meta.a ** 2) + (meta.b & meta.c), metadata) == -3
+    assert evaluate_query((meta.a + 1) * meta.missing < 10, metadata) is MISSING
+    assert evaluate_query(~((meta.a + 1) * meta.missing < 10), metadata) is NEGATED_MISSING
+
+    # deep trees are compiled in several functions
+    q = meta.a
+    for _ in range(200):
+        q = q + 1
+    assert evaluate_query(q, metadata) == 202
+
+    # compilation does not hit the recursion limit
+    q = meta.a
+    for _ in range(5000):
+        q = q + 1
+    assert evaluate_query(q, metadata) == 5002
+
+    # long chains of boolean operators are evaluated in a single function
+    q = meta.c
+    for i in range(5000):
+        q = q & (meta.a > 1) | meta.missing if i % 2 else q & meta.b
+    assert evaluate_query(q, metadata) is True
+    assert evaluate_query(q & meta.missing, metadata) is MISSING
+    assert evaluate_query(q & meta.b, metadata) == 3
+    assert evaluate_query(~meta.missing & q, metadata) is True
+
+
+def test_compile_query_cache(monkeypatch):
+    """Test that queries with the same structure share the same compiled function, and only them"""
+
+    meta = query_base()
+
+    # compiling the same query object again does not even compute its structure
+    q = meta.a * 3
+    compiled = compile_query(q)
+    monkeypatch.setattr(pydocquery.queries_compilation, "_canonical_key", None)
+    assert compile_query(q) is compiled
+    monkeypatch.undo()
+
+    assert compile_query((meta.a + 1) & ql.any([meta.b, 2])) is compile_query((meta.a + 1) & ql.any([meta.b, 2]))
+    assert compile_query(meta.a + 1) is not compile_query(meta.a + 2)
+    assert compile_query(meta.a + 1) is not compile_query(meta.a + True)
+    assert compile_query(meta.a * 0.0) is not compile_query(meta.a * -0.0)
+    assert str(compile_query(meta.a * -0.0)({"a": 1})) == "-0.0"
+
+    # mutable constants are not shared
+    q1, q2 = ql.is_in(meta.a, {1: 0}), ql.is_in(meta.a, {1: 0})
+    assert compile_query(q1) is not compile_query(q2)
+
+
+@pytest.mark.parametrize("nb_items", [1, 3, 100], ids="nb_items={}".format)
+def test_any_all_items(nb_items):
+    """Test `ql.any` and `ql.all` on lists of queries, both when they are unrolled (small lists) or not"""
+
+    meta = query_base()
+    missings = [meta.missing] * (nb_items - 1)
+
+    assert evaluate_query(ql.any(missings + [meta.a]), {"a": 1}) is True
+    assert evaluate_query(ql.any(missings + [meta.a]), {"a": 0}) is False
+    assert evaluate_query(ql.any(missings + [meta.a]), {}) is MISSING
+    assert evaluate_query(ql.any(missings + [~meta.a]), {}) is True
+
+    negated_missings = [~meta.missing] * (nb_items - 1)
+    assert evaluate_query(ql.all(negated_missings + [meta.a]), {"a": 1}) is True
+    assert evaluate_query(ql.all(negated_missings + [meta.a]), {"a": 0}) is False
+    assert evaluate_query(ql.all(negated_missings + [meta.a]), {}) is MISSING
+    assert evaluate_query(ql.all(negated_missings + [~meta.a]), {}) is NEGATED_MISSING
+    assert evaluate_query(ql.all([meta.a] * nb_items + [~meta.missing]), {"a": 1}) is True
+
+
+def test_any_all_folding():
+    """Test that constant items of `ql.any` and `ql.all` are folded when the query is created"""
+
+    meta = query_base()
+
+    def items(q):
+        return tuple(map(id, q.args[0]))
+
+    b_query = ql.all([meta.b])
+    assert items(ql.any([meta.a, 0, True, meta.b])) == items(ql.any([meta.a, True]))
+    assert items(ql.any([meta.a, 0, meta.b, None])) == items(ql.any([meta.a, meta.b, False]))
+    assert items(ql.all([meta.a, 1, False, meta.b])) == items(ql.all([meta.a, False]))
+    assert items(ql.all([meta.a, ql.all([meta.b, "yes"])])) == items(ql.all([meta.a, meta.b, True]))
+    assert ql.any([meta.a, b_query]).args[0][1] is b_query
+
+    # a neutral constant still prevents the result from being a missing
+    assert evaluate_query(ql.any([meta.missing, 0]), {}) is False
+    assert evaluate_query(ql.all([~meta.missing, 1]), {}) is True
+    assert evaluate_query(ql.any([meta.missing, ql.any([meta.missing])]), {}) is MISSING
+    assert evaluate_query(ql.any([meta.missing, ql.any([])]), {}) is False
+
+
+def test_compiled_query_batch():
+    """Test the evaluation of a compiled query on many documents"""
+
+    meta = query_base()
+    metas = [{"a": 1}, {"a": 5}, {}]
+    compiled = compile_query(meta.a > 2)
+
+    assert compiled(metas[1]) is True
+    assert compiled.batch(metas) == [False, True, MISSING]
+    assert compiled.batch(iter(metas)) == [False, True, MISSING]
+
+    np = pytest.importorskip("numpy")
+    assert compiled.mask(metas).tolist() == [False, True, False]
+    assert compile_query(~(meta.a > 2)).mask(iter(metas)).dtype == np.bool_
+
+
+def test_matches():
+    """Test that `ql.matches` compiles its pattern once, and works as expected"""
+
+    meta = query_base()
+    q = ql.matches(meta.a, r"^h[e]+", re.IGNORECASE)
+    assert q.args[1] is ql.matches(meta.b, r"^h[e]+", re.IGNORECASE).args[1]
+    assert len(q.args) == 2
+
+    assert evaluate_query(q, {"a": "Heeey"}) is True
+    assert evaluate_query(q, {"a": "hoy"}) is False
+    assert evaluate_query(q, {"a": 1}) is False
+    assert evaluate_query(q, {}) is MISSING
+
+
+def test_regex_backend(monkeypatch):
+    """Test that an invalid regex backend falls back to `re`, and that only its compilation errors are caught"""
+
+    code = "import pydocquery.queries_lib as ql, re; assert ql._re_backend is re"
+    env = dict(os.environ, PYDOCQUERY_REGEX_BACKEND="foo", PYTHONPATH=os.pathsep.join(sys.path))
+    res = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True)
+    assert res.returncode == 0, res.stderr
+    assert "Invalid PYDOCQUERY_REGEX_BACKEND" in res.stderr
+
+    class Backend:
+        class error(Exception):
+            pass
+
+        @staticmethod
+        def compile(pattern, options=None):
+            if pattern == "bug":
+                raise RuntimeError(pattern)
+            elif pattern == "ok":
+                return "compiled by the backend"
+            raise Backend.error(pattern)
+
+    monkeypatch.setattr(ql, "_re_backend", Backend)
+    assert ql._compile_regex.__wrapped__("ok", 0) == "compiled by the backend"
+    assert ql._compile_regex.__wrapped__("a+", 0) == re.compile("a+")
+    with pytest.raises(RuntimeError):
+        ql._compile_regex.__wrapped__("bug", 0)
+
+    # patterns with flags are compiled with `re`
+    assert ql._compile_regex.__wrapped__("ok", re.IGNORECASE) == re.compile("ok", re.IGNORECASE)
+    assert ql._compile_regex.__wrapped__("bug", re.IGNORECASE).match("BUG")